@@ -14,7 +14,7 @@ class TagAdmin(admin.ModelAdmin):
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    readonly_fields = ('pub_date',)
+    readonly_fields = ('pub_date', 'favorites_count', 'in_carts_count')
     fields = (
         'name',
         'author',
@@ -22,6 +22,8 @@ class RecipeAdmin(admin.ModelAdmin):
         'image',
         'text',
         'cooking_time',
+        'favorites_count',
+        'in_carts_count',
     )
     search_fields = ['name', 'author__username', 'tags__name']
 
@@ -0,0 +1,105 @@
+import threading
+import time
+from bisect import bisect_left
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, IntegerField, Q, Value, When
+
+from .models import Ingredient
+
+INDEX_VERSION_KEY = 'ingredient_index_version'
+PREFIX_END = '\U0010ffff'
+
+
+class IngredientIndex:
+    """In-process sorted prefix index over ingredient names.
+
+    Names are lowercased and kept sorted, so prefix matches are a binary
+    search away; substring matches fill up the rest of the result.
+    The index is rebuilt lazily when the shared version key changes or
+    after ``INGREDIENT_INDEX_TTL`` seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._built_at = None
+        self._index = ([], [])
+
+    def invalidate(self):
+        self._version = None
+        cache.set(INDEX_VERSION_KEY, uuid4().hex, None)
+
+    def build(self):
+        rows = Ingredient.objects.values('id', 'name', 'measurement_unit')
+        entries = sorted(
+            ((row['name'].lower(), row['id']), row) for row in rows
+        )
+        return (
+            [key for (key, _), _ in entries],
+            [row for _, row in entries],
+        )
+
+    def is_stale(self, version):
+        if self._built_at is None or version != self._version:
+            return True
+        age = time.monotonic() - self._built_at
+        return age > settings.INGREDIENT_INDEX_TTL
+
+    def refresh(self):
+        version = cache.get(INDEX_VERSION_KEY)
+        if not self.is_stale(version):
+            return
+        with self._lock:
+            # Another thread may have rebuilt it while this one waited.
+            if not self.is_stale(version):
+                return
+            # Keys and items are swapped in one assignment, so a
+            # concurrent search never pairs new keys with old items.
+            self._index = self.build()
+            self._version = version
+            self._built_at = time.monotonic()
+
+    def search(self, query, limit):
+        self.refresh()
+        query = query.lower()
+        keys, items = self._index
+        start = bisect_left(keys, query)
+        end = bisect_left(keys, query + PREFIX_END, lo=start)
+        result = items[start:min(end, start + limit)]
+        if len(result) == limit:
+            return result
+
+        for key, item in zip(keys, items):
+            if query in key and not key.startswith(query):
+                result.append(item)
+                if len(result) == limit:
+                    break
+        return result
+
+
+def search_ingredients_in_db(query, limit):
+    return list(
+        Ingredient.objects.filter(
+            Q(name__istartswith=query) | Q(name__icontains=query)
+        ).annotate(
+            rank=Case(
+                When(name__istartswith=query, then=Value(0)),
+                default=Value(1),
+                output_field=IntegerField(),
+            )
+        ).order_by('rank', 'name').values(
+            'id', 'name', 'measurement_unit'
+        )[:limit]
+    )
+
+
+ingredient_index = IngredientIndex()
+
+
+def search_ingredients(query, limit):
+    if settings.INGREDIENT_INDEX_ENABLED:
+        return ingredient_index.search(query, limit)
+    return search_ingredients_in_db(query, limit)
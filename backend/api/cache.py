@@ -0,0 +1,115 @@
+import hashlib
+import json
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+RECIPE_LIST_PARAMS = (
+    'page', 'limit', 'author', 'search', 'cursor', 'tags_match',
+    'ingredients',
+)
+RECIPES_BASE_GENERATION = 'recipes:generation:base'
+RECIPES_ALL_GENERATION = 'recipes:generation:all'
+
+
+def tag_generation_key(slug):
+    return f'recipes:generation:tag:{slug}'
+
+
+def author_generation_key(author_id):
+    return f'recipes:generation:author:{author_id}'
+
+
+def bump_generations(*keys):
+    cache.set_many({key: uuid4().hex for key in keys}, None)
+
+
+def get_generations(keys):
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            cache.add(key, uuid4().hex, None)
+            generations[key] = cache.get(key)
+    return [generations[key] for key in keys]
+
+
+def get_recipe_list_cache_key(request):
+    """Key a recipe list page on its normalized query parameters.
+
+    The key embeds the generation of every tag and author the page is
+    filtered on (or the global one for unfiltered pages), so bumping a
+    generation orphans exactly the pages a recipe could appear on.
+    """
+    params = request.query_params
+    tags = sorted(set(params.getlist('tags')))
+    author = params.get('author')
+    generation_keys = [RECIPES_BASE_GENERATION]
+    generation_keys.extend(tag_generation_key(slug) for slug in tags)
+    if author:
+        generation_keys.append(author_generation_key(author))
+    if not tags and not author:
+        generation_keys.append(RECIPES_ALL_GENERATION)
+
+    normalized = [
+        request.get_host(),
+        tags,
+        [params.get(name) for name in RECIPE_LIST_PARAMS],
+        get_generations(generation_keys),
+    ]
+    digest = hashlib.md5(json.dumps(normalized).encode()).hexdigest()
+    return f'recipes:list:{digest}'
+
+
+def invalidate_recipe_lists(author_id=None, tag_slugs=()):
+    """Orphan the pages a recipe of the author and tags can appear on.
+
+    Generations are bumped once the transaction commits: bumped earlier,
+    a concurrent request could cache the rows as they were before the
+    write under the new generation.
+    """
+    keys = [RECIPES_ALL_GENERATION]
+    keys.extend(tag_generation_key(slug) for slug in tag_slugs)
+    if author_id is not None:
+        keys.append(author_generation_key(author_id))
+    transaction.on_commit(lambda: bump_generations(*keys))
+
+
+def invalidate_all_recipe_lists():
+    transaction.on_commit(lambda: bump_generations(RECIPES_BASE_GENERATION))
+
+
+def get_cached_response(key, build_response):
+    """Read-through cache where only one caller rebuilds a missing entry.
+
+    Other callers wait for the entry up to the lock timeout and build the
+    response themselves only if it never shows up.
+    """
+    data = cache.get(key)
+    if data is not None:
+        return Response(data)
+
+    lock_key = f'{key}:lock'
+    lock_timeout = settings.RECIPE_LIST_CACHE_LOCK_TIMEOUT
+    if cache.add(lock_key, True, lock_timeout):
+        try:
+            response = build_response()
+            if response.status_code == status.HTTP_200_OK:
+                cache.set(
+                    key, response.data, settings.RECIPE_LIST_CACHE_TIMEOUT
+                )
+            return response
+        finally:
+            cache.delete(lock_key)
+
+    deadline = time.monotonic() + lock_timeout
+    while time.monotonic() < deadline:
+        time.sleep(settings.RECIPE_LIST_CACHE_POLL_INTERVAL)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+    return build_response()
@@ -8,3 +8,16 @@ IS_IN_SHOPING_CART_VALUES = {
     "true": True,
     "false": False,
 }
+
+
+SHOPPING_CART_FORMATS = {
+    "txt": "text/plain",
+    "csv": "text/csv",
+    "pdf": "application/pdf",
+}
+
+SHOPPING_CART_PDF_FONT = '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+
+TAG_MASK_BITS = 63
+
+TAG_MATCH_MODES = ('any', 'all')
@@ -0,0 +1,291 @@
+import threading
+import time
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from .models import IngredientRecipe
+from .versions import get_changed_recipe_ids
+
+
+IndexSnapshot = namedtuple(
+    'IndexSnapshot', ['postings', 'size_bits', 'recipe_ids', 'ordered']
+)
+
+
+def pack_slots(slots, length):
+    bitset = bytearray(length // 8 + 1)
+    for slot in slots:
+        bitset[slot >> 3] |= 1 << (slot & 7)
+    return int.from_bytes(bitset, 'little')
+
+
+def set_slot_size(size_bits, bit, size):
+    for level in range(max(len(size_bits), size.bit_length())):
+        if level == len(size_bits):
+            size_bits.append(0)
+        if size >> level & 1:
+            size_bits[level] |= bit
+        else:
+            size_bits[level] &= ~bit
+
+
+def count_matches(postings, ingredient_ids):
+    """Return the candidate bitset and the bit-sliced match counters."""
+    candidates = 0
+    counters = []
+    for ingredient_id in set(ingredient_ids):
+        carry = postings.get(ingredient_id, 0)
+        candidates |= carry
+        for level, counter in enumerate(counters):
+            if not carry:
+                break
+            counters[level], carry = counter ^ carry, counter & carry
+        if carry:
+            counters.append(carry)
+    return candidates, counters
+
+
+def subtract_slices(minuend, subtrahend):
+    """Subtract two bit-sliced numbers slot by slot, ripple borrow style."""
+    difference = []
+    borrow = 0
+    for level in range(max(len(minuend), len(subtrahend))):
+        a = minuend[level] if level < len(minuend) else 0
+        b = subtrahend[level] if level < len(subtrahend) else 0
+        difference.append(a ^ b ^ borrow)
+        borrow = (~a & (b | borrow)) | (b & borrow)
+    return difference
+
+
+def iter_slots_descending(bitset, ordered, recipe_ids):
+    if ordered:
+        while bitset:
+            slot = bitset.bit_length() - 1
+            bitset ^= 1 << slot
+            yield slot
+        return
+    bits = bin(bitset)[:1:-1]
+    slots = []
+    slot = bits.find('1')
+    while slot != -1:
+        slots.append(slot)
+        slot = bits.find('1', slot + 1)
+    yield from sorted(slots, key=recipe_ids.__getitem__, reverse=True)
+
+
+class RecipeIngredientIndex:
+    """In-process inverted index from ingredient ids to recipe bitsets.
+
+    Every recipe owns a slot, and each ingredient maps to a Python int with
+    the slots of the recipes using it set. Recipe sizes are bit-sliced the
+    same way: ``size_bits[level]`` holds the slots whose ingredient count
+    has that bit set. Recipes changed since the last sync are found
+    through their content versions and patched copy-on-write into a new
+    snapshot; a full rebuild happens after ``RECIPE_INGREDIENT_INDEX_TTL``
+    seconds. Ranking reads a snapshot, so it never holds the lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built_at = None
+        self._synced_at = None
+        self._slots = {}
+        self._ingredients = {}
+        self._snapshot = IndexSnapshot({}, (), [], True)
+
+    def build(self):
+        recipes = defaultdict(set)
+        for recipe_id, ingredient_id in IngredientRecipe.objects.order_by(
+            'recipe_id'
+        ).values_list('recipe', 'ingredient').iterator():
+            recipes[recipe_id].add(ingredient_id)
+
+        # Slots follow recipe ids, so the newest recipes have the highest.
+        slots = defaultdict(list)
+        size_slots = defaultdict(list)
+        for slot, ingredient_ids in enumerate(recipes.values()):
+            for ingredient_id in ingredient_ids:
+                slots[ingredient_id].append(slot)
+            size = len(ingredient_ids)
+            for level in range(size.bit_length()):
+                if size >> level & 1:
+                    size_slots[level].append(slot)
+        length = len(recipes)
+
+        self._slots = {
+            recipe_id: slot for slot, recipe_id in enumerate(recipes)
+        }
+        self._ingredients = {
+            recipe_id: frozenset(ingredient_ids)
+            for recipe_id, ingredient_ids in recipes.items()
+        }
+        self._snapshot = IndexSnapshot(
+            {
+                ingredient_id: pack_slots(ingredient_slots, length)
+                for ingredient_id, ingredient_slots in slots.items()
+            },
+            tuple(
+                pack_slots(size_slots[level], length)
+                for level in range(max(size_slots, default=-1) + 1)
+            ),
+            list(recipes),
+            True,
+        )
+
+    def set_recipe(self, postings, size_bits, recipe_ids, recipe_id,
+                   ingredient_ids):
+        """Patch one recipe into the given copies of the snapshot.
+
+        Slots are never reused, new recipes are appended. Returns False
+        when that breaks the recipe id order of the slots.
+        """
+        slot = self._slots.get(recipe_id)
+        if slot is not None:
+            bit = 1 << slot
+            for ingredient_id in self._ingredients.pop(recipe_id):
+                postings[ingredient_id] &= ~bit
+            set_slot_size(size_bits, bit, 0)
+        if not ingredient_ids:
+            self._slots.pop(recipe_id, None)
+            return True
+
+        ordered = True
+        if slot is None:
+            ordered = not recipe_ids or recipe_ids[-1] < recipe_id
+            slot = len(recipe_ids)
+            recipe_ids.append(recipe_id)
+            self._slots[recipe_id] = slot
+        bit = 1 << slot
+        ingredient_ids = frozenset(ingredient_ids)
+        for ingredient_id in ingredient_ids:
+            postings[ingredient_id] = postings.get(ingredient_id, 0) | bit
+        self._ingredients[recipe_id] = ingredient_ids
+        set_slot_size(size_bits, bit, len(ingredient_ids))
+        return ordered
+
+    def set_recipes(self, recipes):
+        """Apply ``{recipe_id: ingredient_ids}`` and publish a snapshot.
+
+        Readers keep using the previous snapshot meanwhile: only the
+        ingredient map is copied, and the recipe id list is append-only.
+        """
+        snapshot = self._snapshot
+        postings = dict(snapshot.postings)
+        size_bits = list(snapshot.size_bits)
+        ordered = snapshot.ordered
+        for recipe_id in sorted(recipes):
+            ordered &= self.set_recipe(
+                postings,
+                size_bits,
+                snapshot.recipe_ids,
+                recipe_id,
+                recipes[recipe_id],
+            )
+        self._snapshot = IndexSnapshot(
+            postings, tuple(size_bits), snapshot.recipe_ids, ordered
+        )
+
+    def sync(self, since):
+        recipe_ids = get_changed_recipe_ids(since)
+        if not recipe_ids:
+            return
+        recipes = {recipe_id: [] for recipe_id in recipe_ids}
+        for recipe_id, ingredient_id in IngredientRecipe.objects.filter(
+            recipe__in=recipe_ids
+        ).values_list('recipe', 'ingredient'):
+            recipes[recipe_id].append(ingredient_id)
+        self.set_recipes(recipes)
+
+    def refresh(self):
+        now = timezone.now()
+        if (
+            self._built_at is None
+            or time.monotonic() - self._built_at
+            > settings.RECIPE_INGREDIENT_INDEX_TTL
+        ):
+            self.build()
+            self._built_at = time.monotonic()
+        else:
+            self.sync(self._synced_at - timedelta(
+                seconds=settings.RECIPE_INGREDIENT_INDEX_OVERLAP
+            ))
+        self._synced_at = now
+
+    def rank(self, ingredient_ids, limit):
+        """Return up to ``limit`` ``(recipe_id, missing)`` pairs.
+
+        Only recipes using at least one of the ingredients are ranked,
+        fully cookable ones first, then by the number of missing
+        ingredients and newest first. The number of missing ingredients
+        of every slot is computed at once, as bit-sliced ``size - matched``,
+        then each count is turned into a bitset and only the slots
+        returned are visited.
+        """
+        with self._lock:
+            self.refresh()
+            snapshot = self._snapshot
+
+        candidates, matched = count_matches(snapshot.postings, ingredient_ids)
+        missing = subtract_slices(snapshot.size_bits, matched)
+        ranked = []
+        remaining = candidates
+        for count in range(1 << len(missing)):
+            if not remaining or len(ranked) == limit:
+                break
+            bucket = remaining
+            for level, bits in enumerate(missing):
+                bucket &= bits if count >> level & 1 else ~bits
+            if not bucket:
+                continue
+            remaining &= ~bucket
+            for slot in iter_slots_descending(
+                bucket, snapshot.ordered, snapshot.recipe_ids
+            ):
+                ranked.append((snapshot.recipe_ids[slot], count))
+                if len(ranked) == limit:
+                    break
+        return ranked
+
+
+recipe_ingredient_index = RecipeIngredientIndex()
+
+
+def rank_cookable_recipes_in_db(ingredient_ids, limit):
+    return list(
+        IngredientRecipe.objects.values('recipe').annotate(
+            matched=Count('id', filter=Q(ingredient__in=ingredient_ids)),
+            missing=Count('id') - F('matched'),
+        ).filter(matched__gt=0).order_by(
+            'missing', '-recipe_id'
+        ).values_list('recipe', 'missing')[:limit]
+    )
+
+
+def rank_cookable_recipes(ingredient_ids, limit):
+    if settings.RECIPE_INGREDIENT_INDEX_ENABLED:
+        return recipe_ingredient_index.rank(ingredient_ids, limit)
+    return rank_cookable_recipes_in_db(ingredient_ids, limit)
+
+
+def filter_cookable(queryset, ingredient_ids):
+    """Keep recipes using any of the ingredients, best coverage first."""
+    ranked = rank_cookable_recipes(
+        ingredient_ids, settings.RECIPE_COOKABLE_LIMIT
+    )
+    by_missing = defaultdict(list)
+    for recipe_id, missing in ranked:
+        by_missing[missing].append(recipe_id)
+    return queryset.filter(
+        pk__in=[recipe_id for recipe_id, _ in ranked]
+    ).alias(missing_ingredients=Case(
+        *(
+            When(pk__in=recipe_ids, then=Value(missing))
+            for missing, recipe_ids in by_missing.items()
+        ),
+        default=Value(0),
+        output_field=IntegerField(),
+    )).order_by('missing_ingredients', '-pub_date', '-id')
@@ -0,0 +1,75 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from users.models import Follow
+from .models import Recipe
+
+User = get_user_model()
+
+CATEGORY_COUNTERS = {
+    'users_chose_as_favorite': 'favorites_count',
+    'users_put_in_cart': 'in_carts_count',
+}
+
+
+def change_counters(model, pks, field, delta):
+    """Atomically add ``delta`` to a counter column of the given rows.
+
+    Counters never go below zero: rows that drifted are left to
+    ``recount``.
+    """
+    rows = model.objects.filter(pk__in=pks)
+    if delta < 0:
+        rows = rows.filter(**{f'{field}__gte': -delta})
+    rows.update(**{field: F(field) + delta})
+
+
+def change_counter(model, pk, field, delta):
+    change_counters(model, [pk], field, delta)
+
+
+def count_rows(queryset, field):
+    counts = queryset.filter(
+        **{field: OuterRef('pk')}
+    ).order_by().values(field).annotate(total=Count('*')).values('total')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def get_counters_drift():
+    """Return how many rows hold a counter that disagrees with the source."""
+    return {
+        'recipes': Recipe.objects.annotate(
+            real_favorites=count_rows(
+                Recipe.users_chose_as_favorite.through.objects, 'recipe'
+            ),
+            real_in_carts=count_rows(
+                Recipe.users_put_in_cart.through.objects, 'recipe'
+            ),
+        ).exclude(
+            favorites_count=F('real_favorites'),
+            in_carts_count=F('real_in_carts'),
+        ).count(),
+        'users': User.objects.annotate(
+            real_recipes=count_rows(Recipe.objects, 'author'),
+            real_followers=count_rows(Follow.objects, 'following'),
+        ).exclude(
+            recipes_count=F('real_recipes'),
+            followers_count=F('real_followers'),
+        ).count(),
+    }
+
+
+def recount_all():
+    Recipe.objects.update(
+        favorites_count=count_rows(
+            Recipe.users_chose_as_favorite.through.objects, 'recipe'
+        ),
+        in_carts_count=count_rows(
+            Recipe.users_put_in_cart.through.objects, 'recipe'
+        ),
+    )
+    User.objects.update(
+        recipes_count=count_rows(Recipe.objects, 'author'),
+        followers_count=count_rows(Follow.objects, 'following'),
+    )
@@ -0,0 +1,50 @@
+import csv
+import os
+
+from fpdf import FPDF
+
+from .constants import SHOPPING_CART_PDF_FONT
+
+
+class Echo:
+    """File-like object that returns written value instead of buffering."""
+
+    def write(self, value):
+        return value
+
+
+def shopping_cart_txt(rows):
+    for row in rows:
+        yield (f'{row["name"]} ({row["measurement_unit"]}) - '
+               f'{row["total_amount"]} \n')
+
+
+def shopping_cart_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'measurement_unit', 'amount'))
+    for row in rows:
+        yield writer.writerow(
+            (row['name'], row['measurement_unit'], row['total_amount'])
+        )
+
+
+def shopping_cart_pdf(rows):
+    pdf = FPDF()
+    pdf.add_page()
+    if os.path.exists(SHOPPING_CART_PDF_FONT):
+        pdf.add_font('DejaVu', '', SHOPPING_CART_PDF_FONT, uni=True)
+        pdf.set_font('DejaVu', size=12)
+    else:
+        pdf.set_font('Helvetica', size=12)
+    for line in shopping_cart_txt(rows):
+        if pdf.font_family != 'dejavu':
+            line = line.encode('latin-1', 'replace').decode('latin-1')
+        pdf.cell(0, 8, txt=line.strip(), ln=1)
+    yield pdf.output(dest='S').encode('latin-1')
+
+
+SHOPPING_CART_RENDERERS = {
+    'txt': shopping_cart_txt,
+    'csv': shopping_cart_csv,
+    'pdf': shopping_cart_pdf,
+}
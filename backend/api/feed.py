@@ -0,0 +1,111 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+
+from users.models import Follow
+from .models import FeedEntry, Recipe
+
+User = get_user_model()
+
+
+def is_pulled_author(author_id):
+    """Authors with too many followers are read at query time instead.
+
+    Writing a timeline row for every follower of such an author would make
+    publishing a recipe cost as much as the author's audience.
+    """
+    return User.objects.filter(
+        pk=author_id,
+        followers_count__gte=settings.FEED_FANOUT_MAX_FOLLOWERS,
+    ).exists()
+
+
+def push_to_feeds(user_ids, recipes):
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(
+                user_id=user_id,
+                recipe_id=recipe_id,
+                author_id=author_id,
+                pub_date=pub_date,
+            )
+            for user_id in user_ids
+            for recipe_id, author_id, pub_date in recipes
+        ),
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+def fan_out_recipe(recipe):
+    """Push a new recipe to the timelines of its author's followers."""
+    if is_pulled_author(recipe.author_id):
+        return
+    push_to_feeds(
+        Follow.objects.filter(
+            following=recipe.author_id
+        ).values_list('user', flat=True).iterator(),
+        [(recipe.pk, recipe.author_id, recipe.pub_date)],
+    )
+
+
+def trim_feed(user_id):
+    """Drop the entries beyond FEED_MAX_LENGTH from a user's timeline."""
+    entries = FeedEntry.objects.filter(user=user_id)
+    cutoff = entries.order_by('-pub_date', '-recipe').values(
+        'pub_date', 'recipe'
+    )[settings.FEED_MAX_LENGTH:settings.FEED_MAX_LENGTH + 1].first()
+    if cutoff is None:
+        return
+    entries.filter(
+        Q(pub_date__lt=cutoff['pub_date'])
+        | Q(pub_date=cutoff['pub_date'], recipe__lte=cutoff['recipe'])
+    ).delete()
+
+
+def backfill_feed(user_id, author_id):
+    """Copy the latest recipes of a newly followed author to the timeline."""
+    if is_pulled_author(author_id):
+        return
+    push_to_feeds(
+        [user_id],
+        Recipe.objects.filter(author=author_id).order_by(
+            '-pub_date', '-id'
+        ).values_list(
+            'id', 'author', 'pub_date'
+        )[:settings.FEED_BACKFILL_SIZE],
+    )
+    trim_feed(user_id)
+
+
+def remove_author_from_feed(user_id, author_id):
+    FeedEntry.objects.filter(user=user_id, author=author_id).delete()
+
+
+def get_feed_sources(user):
+    """Return the ``(queryset, recipe id field)`` sources of a timeline.
+
+    Pushed entries are paged straight from the timeline table and its
+    (user, pub_date, recipe) index. Recipes of pulled authors are read from
+    the recipe table.
+    """
+    sources = [(FeedEntry.objects.filter(user=user), 'recipe')]
+    pulled_authors = list(Follow.objects.filter(
+        user=user,
+        following__followers_count__gte=settings.FEED_FANOUT_MAX_FOLLOWERS,
+    ).values_list('following', flat=True))
+    if pulled_authors:
+        sources.append(
+            (Recipe.objects.filter(author__in=pulled_authors), 'id')
+        )
+    return sources
+
+
+def trim_all_feeds():
+    """Trim every timeline, return the number of timelines visited."""
+    user_ids = list(FeedEntry.objects.order_by('user').values_list(
+        'user', flat=True
+    ).distinct())
+    for user_id in user_ids:
+        trim_feed(user_id)
+    return len(user_ids)
@@ -1,7 +1,19 @@
 import django_filters
+from django.conf import settings
+from django.db.models import Q
 
-from .constants import IS_FAVORITED_VALUES, IS_IN_SHOPING_CART_VALUES
+from .constants import (IS_FAVORITED_VALUES, IS_IN_SHOPING_CART_VALUES,
+                        TAG_MATCH_MODES)
+from .cookable import filter_cookable
+from .memberships import get_memberships
 from .models import Ingredient, Recipe, Tag
+from .search import search_recipes
+from .tag_masks import filter_by_tags_mask, get_tags_mask
+
+
+class NumberInFilter(django_filters.BaseInFilter,
+                     django_filters.NumberFilter):
+    pass
 
 
 class RecipeFilter(django_filters.FilterSet):
@@ -10,25 +22,66 @@ class RecipeFilter(django_filters.FilterSet):
         field_name='tags__slug',
         queryset=Tag.objects.all(),
         to_field_name='slug',
+        method='get_tags',
+    )
+    tags_match = django_filters.ChoiceFilter(
+        choices=[(mode, mode) for mode in TAG_MATCH_MODES],
+        method='get_tags_match',
     )
     is_favorited = django_filters.CharFilter(method='get_is_favorited')
     is_in_shopping_cart = django_filters.CharFilter(
         method='get_is_in_shopping_cart'
     )
+    search = django_filters.CharFilter(method='get_search')
+    ingredients = NumberInFilter(method='get_ingredients')
 
     class Meta:
         model = Recipe
         fields = ('author', 'tags', 'is_favorited')
 
+    def get_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        return filter_by_tags_mask(
+            queryset,
+            get_tags_mask(value),
+            match_all=self.form.cleaned_data.get('tags_match') == 'all',
+        )
+
+    def get_tags_match(self, queryset, name, value):
+        return queryset
+
+    def filter_membership(self, queryset, related_name, id_set, include):
+        """Filter on a membership set, inlined as ids while it is small."""
+        if len(id_set) <= settings.MEMBERSHIP_FILTER_MAX_IDS:
+            condition = Q(pk__in=id_set.to_list())
+        else:
+            condition = Q(**{related_name: self.request.user})
+        if include:
+            return queryset.filter(condition)
+        return queryset.exclude(condition)
+
     def get_is_favorited(self, queryset, name, value):
-        if IS_FAVORITED_VALUES[value]:
-            return queryset.filter(users_chose_as_favorite=self.request.user)
-        return queryset.exclude(users_chose_as_favorite=self.request.user)
+        return self.filter_membership(
+            queryset,
+            'users_chose_as_favorite',
+            get_memberships(self.request).favorites,
+            IS_FAVORITED_VALUES[value],
+        )
 
     def get_is_in_shopping_cart(self, queryset, name, value):
-        if IS_IN_SHOPING_CART_VALUES[value]:
-            return queryset.filter(users_put_in_cart=self.request.user)
-        return queryset.exclude(users_put_in_cart=self.request.user)
+        return self.filter_membership(
+            queryset,
+            'users_put_in_cart',
+            get_memberships(self.request).cart,
+            IS_IN_SHOPING_CART_VALUES[value],
+        )
+
+    def get_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
+
+    def get_ingredients(self, queryset, name, value):
+        return filter_cookable(queryset, [int(pk) for pk in value])
 
 
 class IngredientFilter(django_filters.FilterSet):
@@ -0,0 +1,98 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+
+from .memberships import get_memberships
+from .models import IngredientRecipe, Recipe
+from .serializers import RecipeSerializer
+from .versions import (INGREDIENTS_VERSION, TAGS_VERSION, get_version_map,
+                       recipe_content_version_key, user_content_version_key)
+
+
+def get_recipe_queryset():
+    return Recipe.objects.defer('search_vector').select_related(
+        'author'
+    ).prefetch_related(
+        'tags',
+        Prefetch(
+            'recipe_ingredients',
+            queryset=IngredientRecipe.objects.select_related('ingredient')
+        ),
+    )
+
+
+def get_fragment_key(request, recipe_id, versions):
+    # Image URLs are absolute, so fragments differ per scheme and host.
+    origin = hashlib.md5(request.build_absolute_uri('/').encode()).hexdigest()
+    return f'recipes:fragment:{recipe_id}:{versions}:{origin}'
+
+
+def build_fragments(request, recipe_ids):
+    recipes = get_recipe_queryset().filter(pk__in=recipe_ids)
+    return {
+        data['id']: json.dumps(data)
+        for data in RecipeSerializer(
+            recipes, many=True, context={'request': request}
+        ).data
+    }
+
+
+def render_recipes(request, recipe_ids):
+    """Serialize recipes in ``recipe_ids`` order, skipping missing ones.
+
+    The viewer-independent part of every recipe is cached as JSON under
+    the content versions of the recipe, its author, tags and ingredients,
+    which favorites, carts and follows do not bump; the viewer's flags
+    come from their membership sets.
+    """
+    authors = dict(
+        Recipe.objects.filter(pk__in=recipe_ids).values_list('id', 'author')
+    )
+    versions = get_version_map([
+        TAGS_VERSION,
+        INGREDIENTS_VERSION,
+        *map(recipe_content_version_key, authors),
+        *map(user_content_version_key, authors.values()),
+    ])
+    keys = {
+        recipe_id: get_fragment_key(request, recipe_id, '.'.join(
+            str(versions[key]) for key in (
+                recipe_content_version_key(recipe_id),
+                user_content_version_key(author_id),
+                TAGS_VERSION,
+                INGREDIENTS_VERSION,
+            )
+        ))
+        for recipe_id, author_id in authors.items()
+    }
+    fragments = cache.get_many(list(keys.values()))
+    missing = [
+        recipe_id for recipe_id, key in keys.items() if key not in fragments
+    ]
+    if missing:
+        built = {
+            keys[recipe_id]: fragment
+            for recipe_id, fragment in build_fragments(
+                request, missing
+            ).items()
+        }
+        cache.set_many(built, settings.RECIPE_FRAGMENT_CACHE_TIMEOUT)
+        fragments.update(built)
+
+    memberships = get_memberships(request)
+    results = []
+    for recipe_id in recipe_ids:
+        key = keys.get(recipe_id)
+        if key not in fragments:
+            continue
+        data = json.loads(fragments[key])
+        data['is_favorited'] = recipe_id in memberships.favorites
+        data['is_in_shopping_cart'] = recipe_id in memberships.cart
+        data['author']['is_subscribed'] = (
+            authors[recipe_id] in memberships.following
+        )
+        results.append(data)
+    return results
@@ -0,0 +1,89 @@
+import posixpath
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from .models import Recipe
+
+# Variants are stored in every format so clients without WebP support
+# can fall back to JPEG.
+VARIANT_FORMATS = (
+    ('webp', 'WEBP', 'webp'),
+    ('jpeg', 'JPEG', 'jpg'),
+)
+VARIANTS_DIRECTORY = 'recipes/variants'
+
+
+def get_variant_name(variant, extension):
+    # Only the directory and extension are kept: the storage names the
+    # file after its content.
+    return posixpath.join(VARIANTS_DIRECTORY, f'{variant}.{extension}')
+
+
+def flatten(image):
+    """Return an RGB copy, compositing transparency over white."""
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def generate_variants(source):
+    """Write the resized variants of an uploaded image to the storage.
+
+    The orientation tag is applied to the pixels first, then no metadata
+    is carried over, so EXIF (camera, GPS...) never reaches the variants.
+    Returns the ``image_variants`` value to store on the recipe.
+    """
+    variants = {'source': source}
+    with default_storage.open(source) as file, Image.open(file) as image:
+        image = flatten(ImageOps.exif_transpose(image))
+        for variant, size in settings.RECIPE_IMAGE_VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail(size, Image.LANCZOS)
+            variants[variant] = {}
+            for key, image_format, extension in VARIANT_FORMATS:
+                buffer = BytesIO()
+                resized.save(
+                    buffer,
+                    image_format,
+                    quality=settings.RECIPE_IMAGE_QUALITY,
+                    optimize=image_format == 'JPEG',
+                )
+                variants[variant][key] = default_storage.save(
+                    get_variant_name(variant, extension),
+                    ContentFile(buffer.getvalue()),
+                )
+    return variants
+
+
+def get_existing_variants(source):
+    """Variants already generated for the same image by another recipe."""
+    return Recipe.objects.filter(
+        image=source, image_variants__source=source
+    ).values_list('image_variants', flat=True).first()
+
+
+def needs_variants(recipe):
+    return bool(recipe.image) and (
+        recipe.image_variants.get('source') != recipe.image.name
+    )
+
+
+def get_variant_urls(recipe, request=None):
+    urls = {}
+    for variant, names in recipe.image_variants.items():
+        if variant == 'source':
+            continue
+        urls[variant] = {}
+        for key, name in names.items():
+            url = default_storage.url(name)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            urls[variant][key] = url
+    return urls
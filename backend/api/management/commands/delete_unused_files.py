@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.media import delete_unused_files
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete media files unused for MEDIA_UNUSED_FILE_GRACE_PERIOD '
+        'seconds, meant to run periodically'
+    )
+
+    def handle(self, *args, **options):
+        deleted = delete_unused_files()
+        self.stdout.write(self.style.SUCCESS(
+            f'{deleted} files unused for '
+            f'{settings.MEDIA_UNUSED_FILE_GRACE_PERIOD} seconds deleted'
+        ))
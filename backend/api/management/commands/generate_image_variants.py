@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.cache import invalidate_all_recipe_lists
+from api.images import generate_variants, needs_variants
+from api.media import get_recipe_files, update_references
+from api.models import Recipe
+from api.versions import (bump_version, recipe_content_version_key,
+                          recipe_version_key)
+
+
+class Command(BaseCommand):
+    help = 'Generate the resized image variants of recipes missing them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Regenerate the variants of every recipe',
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.only(
+            'id', 'image', 'image_variants'
+        ).exclude(image='').order_by('id')
+        generated = failed = 0
+        for recipe in recipes.iterator():
+            if not options['force'] and not needs_variants(recipe):
+                continue
+            try:
+                variants = generate_variants(recipe.image.name)
+            except (OSError, ValueError) as error:
+                failed += 1
+                self.stderr.write(f'Recipe {recipe.pk}: {error}')
+                continue
+            stored_files = get_recipe_files(recipe)
+            recipe.image_variants = variants
+            with transaction.atomic():
+                Recipe.objects.filter(pk=recipe.pk).update(
+                    image_variants=variants
+                )
+                update_references(stored_files, get_recipe_files(recipe))
+                bump_version(
+                    recipe_version_key(recipe.pk),
+                    recipe_content_version_key(recipe.pk),
+                )
+            generated += 1
+
+        if generated:
+            invalidate_all_recipe_lists()
+        self.stdout.write(self.style.SUCCESS(
+            f'{generated} recipes processed, {failed} failed'
+        ))
@@ -1,17 +1,160 @@
+import csv
+import io
 import json
+import os
+import time
+from itertools import islice
 
+from api.autocomplete import ingredient_index
 from api.models import Ingredient
-from django.core.management.base import BaseCommand
+from api.versions import INGREDIENTS_VERSION, bump_version
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+FORMATS = ('json', 'ndjson', 'csv')
+JSON_SEPARATORS = ' \t\r\n,'
+
+
+def iter_json_array(file, chunk_size=64 * 1024):
+    """Yield the items of a top-level JSON array without loading it all."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = finished = False
+    for chunk in iter(lambda: file.read(chunk_size), ''):
+        buffer += chunk
+        position = 0
+        while True:
+            while position < len(buffer) and (
+                buffer[position] in JSON_SEPARATORS
+            ):
+                position += 1
+            if position == len(buffer):
+                break
+            if not started:
+                if buffer[position] != '[':
+                    raise CommandError('Expected a JSON array')
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                finished = True
+                position += 1
+                break
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break
+            yield item
+        buffer = buffer[position:]
+    if not finished or buffer.strip():
+        raise CommandError('Malformed JSON array')
+
+
+def iter_ndjson(file):
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_csv(file):
+    yield from csv.DictReader(file)
+
+
+READERS = {
+    'json': iter_json_array,
+    'ndjson': iter_ndjson,
+    'csv': iter_csv,
+}
+
+
+def iter_unique_rows(items):
+    seen = set()
+    for item in items:
+        row = (item['name'].strip(), item['measurement_unit'].strip())
+        if row not in seen:
+            seen.add(row)
+            yield row
+
+
+def insert_with_orm(rows):
+    Ingredient.objects.bulk_create(
+        [
+            Ingredient(name=name, measurement_unit=measurement_unit)
+            for name, measurement_unit in rows
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def insert_with_copy(rows):
+    data = io.StringIO()
+    csv.writer(data).writerows(rows)
+    data.seek(0)
+    table = Ingredient._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE TEMP TABLE ingredient_load '
+            '(name varchar(200), measurement_unit varchar(200)) '
+            'ON COMMIT DROP'
+        )
+        cursor.cursor.copy_expert(
+            'COPY ingredient_load FROM STDIN WITH (FORMAT csv)', data
+        )
+        cursor.execute(
+            f'INSERT INTO {table} (name, measurement_unit) '
+            'SELECT name, measurement_unit FROM ingredient_load '
+            'ON CONFLICT DO NOTHING'
+        )
 
 
 class Command(BaseCommand):
     help = 'Fill the base with ingredients'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default='data/ingredients.json'
+        )
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            help='Input format, guessed from the file extension by default',
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+
     def handle(self, *args, **options):
-        with open('data/ingredients.json', encoding='utf-8') as file:
-            data = json.load(file)
-            for item in data:
-                Ingredient.objects.get_or_create(
-                    name=item['name'],
-                    measurement_unit=item['measurement_unit']
-                )
+        path = options['path']
+        file_format = options['format'] or (
+            os.path.splitext(path)[1].lstrip('.').lower()
+        )
+        if file_format not in FORMATS:
+            raise CommandError(
+                f'Unknown format "{file_format}", use --format'
+            )
+        insert = (
+            insert_with_copy if connection.vendor == 'postgresql'
+            else insert_with_orm
+        )
+
+        started_at = time.monotonic()
+        before = Ingredient.objects.count()
+        total = 0
+        with open(path, encoding='utf-8', newline='') as file:
+            rows = iter_unique_rows(READERS[file_format](file))
+            while True:
+                batch = list(islice(rows, options['batch_size']))
+                if not batch:
+                    break
+                with transaction.atomic():
+                    insert(batch)
+                total += len(batch)
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'{total} rows read')
+
+        ingredient_index.invalidate()
+        bump_version(INGREDIENTS_VERSION)
+        elapsed = max(time.monotonic() - started_at, 1e-6)
+        created = Ingredient.objects.count() - before
+        self.stdout.write(self.style.SUCCESS(
+            f'{total} rows read, {created} ingredients created '
+            f'in {elapsed:.2f}s ({total / elapsed:.0f} rows/s)'
+        ))
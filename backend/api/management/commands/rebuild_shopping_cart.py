@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import ShoppingCartIngredient
+from api.shopping_cart import get_source_totals
+
+
+class Command(BaseCommand):
+    help = 'Rebuild shopping cart totals from the recipes in users carts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only report drift, do not rewrite the totals',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            source = get_source_totals()
+            stored = {
+                (user_id, ingredient_id): total
+                for user_id, ingredient_id, total in (
+                    ShoppingCartIngredient.objects.select_for_update()
+                    .values_list('user', 'ingredient', 'total_amount')
+                )
+            }
+            drift = {
+                key for key in source.keys() | stored.keys()
+                if source.get(key) != stored.get(key)
+            }
+            self.stdout.write(
+                f'{len(source)} totals, {len(drift)} drifted'
+            )
+            if options['check'] or not drift:
+                return
+
+            ShoppingCartIngredient.objects.all().delete()
+            ShoppingCartIngredient.objects.bulk_create(
+                (
+                    ShoppingCartIngredient(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        total_amount=total,
+                    )
+                    for (user_id, ingredient_id), total in source.items()
+                ),
+                batch_size=1000,
+            )
+            self.stdout.write(self.style.SUCCESS('Totals rebuilt'))
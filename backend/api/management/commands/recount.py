@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.counters import get_counters_drift, recount_all
+
+
+class Command(BaseCommand):
+    help = 'Recompute recipe and user counters from the source tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only report drift, do not rewrite the counters',
+        )
+
+    def handle(self, *args, **options):
+        drift = get_counters_drift()
+        self.stdout.write(
+            f'{drift["recipes"]} recipes and {drift["users"]} users drifted'
+        )
+        if options['check'] or not any(drift.values()):
+            return
+        with transaction.atomic():
+            recount_all()
+        self.stdout.write(self.style.SUCCESS('Counters recomputed'))
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.feed import trim_all_feeds
+
+
+class Command(BaseCommand):
+    help = (
+        'Cut every subscription timeline down to FEED_MAX_LENGTH entries, '
+        'meant to run periodically'
+    )
+
+    def handle(self, *args, **options):
+        trimmed = trim_all_feeds()
+        self.stdout.write(self.style.SUCCESS(
+            f'{trimmed} timelines trimmed to {settings.FEED_MAX_LENGTH}'
+        ))
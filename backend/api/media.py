@@ -0,0 +1,96 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import StoredFile
+
+UNUSED_FILES_BATCH_SIZE = 500
+
+
+def get_recipe_files(recipe):
+    """Names of the stored files a recipe points at."""
+    files = set()
+    if recipe.image:
+        files.add(recipe.image.name)
+    for variant, names in recipe.image_variants.items():
+        if variant != 'source':
+            files.update(names.values())
+    return files
+
+
+def add_references(names):
+    if not names:
+        return
+    StoredFile.objects.bulk_create(
+        [StoredFile(name=name) for name in names], ignore_conflicts=True
+    )
+    StoredFile.objects.filter(name__in=names).update(
+        references=F('references') + 1, released_at=None
+    )
+
+
+def remove_references(names):
+    """Drop one reference to each file.
+
+    Unused files keep their row at zero references and are only deleted
+    by ``delete_unused_files`` once released for a while, so a request
+    reusing the same content meanwhile never ends up pointing at a
+    deleted file.
+    """
+    if not names:
+        return
+    StoredFile.objects.filter(name__in=names, references__gt=0).update(
+        references=F('references') - 1
+    )
+    StoredFile.objects.filter(
+        name__in=names, references=0, released_at=None
+    ).update(released_at=timezone.now())
+
+
+def claim_file(name):
+    """Restart the grace period of a file about to be reused.
+
+    Called by the storage before it checks that the file exists: the row
+    stays locked until the caller's transaction ends, so a concurrent
+    ``delete_unused_files`` either skips the file or has deleted it
+    already and the storage writes it again.
+    """
+    StoredFile.objects.filter(name=name, references=0).update(
+        released_at=timezone.now()
+    )
+
+
+def delete_unused_files():
+    """Delete the files unused for ``MEDIA_UNUSED_FILE_GRACE_PERIOD``.
+
+    Returns the number of files deleted.
+    """
+    released_before = timezone.now() - timedelta(
+        seconds=settings.MEDIA_UNUSED_FILE_GRACE_PERIOD
+    )
+    unused = StoredFile.objects.filter(
+        references=0, released_at__lt=released_before
+    )
+    names = list(unused.values_list('name', flat=True))
+    deleted = 0
+    for start in range(0, len(names), UNUSED_FILES_BATCH_SIZE):
+        with transaction.atomic():
+            # Rows are checked again under the lock, a reference may have
+            # been added since they were listed.
+            locked = list(unused.select_for_update(skip_locked=True).filter(
+                name__in=names[start:start + UNUSED_FILES_BATCH_SIZE]
+            ).values_list('name', flat=True))
+            for name in locked:
+                default_storage.delete(name)
+            StoredFile.objects.filter(name__in=locked).delete()
+        deleted += len(locked)
+    return deleted
+
+
+def update_references(old_names, new_names):
+    add_references(new_names - old_names)
+    remove_references(old_names - new_names)
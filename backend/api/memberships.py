@@ -0,0 +1,163 @@
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from users.models import Follow
+from .cache import bump_generations, get_generations
+from .models import Recipe
+
+FAVORITES = 'favorites'
+CART = 'cart'
+FOLLOWING = 'following'
+
+CATEGORY_MEMBERSHIPS = {
+    'users_chose_as_favorite': FAVORITES,
+    'users_put_in_cart': CART,
+}
+
+
+class IdSet:
+    """Sorted array of ids, 8 bytes per member and O(log n) lookups."""
+
+    __slots__ = ('_ids',)
+
+    def __init__(self, ids=()):
+        self._ids = array('q', sorted(set(ids)))
+
+    @classmethod
+    def from_bytes(cls, data):
+        id_set = cls()
+        id_set._ids.frombytes(data)
+        return id_set
+
+    def to_bytes(self):
+        return self._ids.tobytes()
+
+    def to_list(self):
+        return self._ids.tolist()
+
+    def __contains__(self, pk):
+        index = bisect_left(self._ids, pk)
+        return index < len(self._ids) and self._ids[index] == pk
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, pk):
+        index = bisect_left(self._ids, pk)
+        if index == len(self._ids) or self._ids[index] != pk:
+            self._ids.insert(index, pk)
+
+    def discard(self, pk):
+        index = bisect_left(self._ids, pk)
+        if index < len(self._ids) and self._ids[index] == pk:
+            del self._ids[index]
+
+
+def get_membership_key(user_id, kind):
+    return f'memberships:{kind}:{user_id}'
+
+
+def get_membership_generation_key(user_id, kind):
+    return f'memberships:generation:{kind}:{user_id}'
+
+
+def load_membership(user_id, kind):
+    if kind == FOLLOWING:
+        ids = Follow.objects.filter(user=user_id).values_list(
+            'following', flat=True
+        )
+    elif kind == FAVORITES:
+        ids = Recipe.users_chose_as_favorite.through.objects.filter(
+            user=user_id
+        ).values_list('recipe', flat=True)
+    else:
+        ids = Recipe.users_put_in_cart.through.objects.filter(
+            user=user_id
+        ).values_list('recipe', flat=True)
+    return IdSet(ids.iterator())
+
+
+class Memberships:
+    """Favorites, cart and followed authors of one user, loaded lazily."""
+
+    def __init__(self, user):
+        self.user_id = user.pk if user.is_authenticated else None
+        self._sets = {}
+
+    def get(self, kind):
+        if kind in self._sets:
+            return self._sets[kind]
+        if self.user_id is None:
+            id_set = IdSet()
+        else:
+            id_set = self.load(kind)
+        self._sets[kind] = id_set
+        return id_set
+
+    def load(self, kind):
+        """Read the cached set, reloading it when written by an older
+        generation.
+
+        The generation is read before the database, so a set loaded
+        before a concurrent change commits is cached under the generation
+        that change replaces and never served.
+        """
+        key = get_membership_key(self.user_id, kind)
+        generation_key = get_membership_generation_key(self.user_id, kind)
+        cached = cache.get_many([key, generation_key])
+        generation = cached.get(generation_key)
+        if generation is None:
+            generation, = get_generations([generation_key])
+        if key in cached and cached[key][0] == generation:
+            return IdSet.from_bytes(cached[key][1])
+        id_set = load_membership(self.user_id, kind)
+        cache.set(
+            key,
+            (generation, id_set.to_bytes()),
+            settings.MEMBERSHIP_CACHE_TIMEOUT,
+        )
+        return id_set
+
+    @property
+    def favorites(self):
+        return self.get(FAVORITES)
+
+    @property
+    def cart(self):
+        return self.get(CART)
+
+    @property
+    def following(self):
+        return self.get(FOLLOWING)
+
+
+def get_memberships(request):
+    """Return the memberships of the request user, once per request."""
+    memberships = getattr(request, '_memberships', None)
+    if memberships is None:
+        memberships = Memberships(request.user)
+        request._memberships = memberships
+    return memberships
+
+
+def update_membership(request, kind, added=(), removed=()):
+    """Apply a change of the request user's set to this request at once
+    and retire the cached set after commit.
+
+    The cached set is never patched in place: two changes made at the
+    same time would overwrite each other. The next read reloads it from
+    the database instead.
+    """
+    loaded = get_memberships(request)._sets.get(kind)
+    if loaded is not None:
+        for pk in added:
+            loaded.add(pk)
+        for pk in removed:
+            loaded.discard(pk)
+
+    generation_key = get_membership_generation_key(request.user.pk, kind)
+    transaction.on_commit(lambda: bump_generations(generation_key))
@@ -0,0 +1,58 @@
+# Generated by Django 3.2.7 on 2026-10-18 18:10
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+import django.db.models.deletion
+
+
+def fill_shopping_cart_totals(apps, schema_editor):
+    Recipe = apps.get_model('api', 'Recipe')
+    ShoppingCartIngredient = apps.get_model('api', 'ShoppingCartIngredient')
+    cart = Recipe.users_put_in_cart.through.objects.filter(
+        recipe__ingredients__isnull=False
+    ).values_list(
+        'user', 'recipe__ingredients__ingredient'
+    ).annotate(Sum('recipe__ingredients__amount'))
+    ShoppingCartIngredient.objects.bulk_create(
+        (
+            ShoppingCartIngredient(
+                user_id=user_id,
+                ingredient_id=ingredient_id,
+                total_amount=total,
+            )
+            for user_id, ingredient_id, total in cart
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0004_recipe_keyset_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingCartIngredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_amount', models.PositiveIntegerField()),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_cart_totals', to='api.ingredient')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_cart_ingredients', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Shopping cart ingredient',
+                'verbose_name_plural': 'Shopping cart ingredients',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcartingredient',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_shopping_cart_ingredient'),
+        ),
+        migrations.RunPython(
+            fill_shopping_cart_totals, migrations.RunPython.noop
+        ),
+    ]
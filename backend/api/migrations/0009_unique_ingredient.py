@@ -0,0 +1,47 @@
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    Ingredient = apps.get_model('api', 'Ingredient')
+    IngredientRecipe = apps.get_model('api', 'IngredientRecipe')
+    ShoppingCartIngredient = apps.get_model('api', 'ShoppingCartIngredient')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(keep_id=Min('id'), total=Count('id')).filter(total__gt=1)
+    for group in duplicates:
+        extra_ids = list(Ingredient.objects.filter(
+            name=group['name'], measurement_unit=group['measurement_unit']
+        ).exclude(id=group['keep_id']).values_list('id', flat=True))
+        IngredientRecipe.objects.filter(ingredient_id__in=extra_ids).update(
+            ingredient_id=group['keep_id']
+        )
+        for row in ShoppingCartIngredient.objects.filter(
+            ingredient_id__in=extra_ids
+        ):
+            kept, created = ShoppingCartIngredient.objects.get_or_create(
+                user_id=row.user_id,
+                ingredient_id=group['keep_id'],
+                defaults={'total_amount': 0},
+            )
+            kept.total_amount += row.total_amount
+            kept.save()
+            row.delete()
+        Ingredient.objects.filter(id__in=extra_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_content_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
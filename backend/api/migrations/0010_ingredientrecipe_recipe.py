@@ -0,0 +1,17 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_unique_ingredient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredientrecipe',
+            name='recipe',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='recipe_ingredients', to='api.recipe'),
+        ),
+    ]
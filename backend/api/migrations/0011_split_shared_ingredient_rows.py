@@ -0,0 +1,41 @@
+from django.db import migrations
+
+
+def split_shared_ingredient_rows(apps, schema_editor):
+    """Give every recipe its own IngredientRecipe rows.
+
+    Amounts of an ingredient listed twice in one recipe are summed, as the
+    shopping list already did.
+    """
+    Recipe = apps.get_model('api', 'Recipe')
+    IngredientRecipe = apps.get_model('api', 'IngredientRecipe')
+    amounts = {}
+    shared_rows = Recipe.ingredients.through.objects.values_list(
+        'recipe_id', 'ingredientrecipe__ingredient_id',
+        'ingredientrecipe__amount',
+    )
+    for recipe_id, ingredient_id, amount in shared_rows.iterator():
+        key = (recipe_id, ingredient_id)
+        amounts[key] = amounts.get(key, 0) + amount
+
+    IngredientRecipe.objects.filter(recipe__isnull=True).delete()
+    IngredientRecipe.objects.bulk_create(
+        (
+            IngredientRecipe(
+                recipe_id=recipe_id, ingredient_id=ingredient_id, amount=amount
+            )
+            for (recipe_id, ingredient_id), amount in amounts.items()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_ingredientrecipe_recipe'),
+    ]
+
+    operations = [
+        migrations.RunPython(split_shared_ingredient_rows),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 3.2.7 on 2026-10-18 18:24
+
+from django.db import migrations
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def merge_favorites(apps, schema_editor):
+    Recipe = apps.get_model('api', 'Recipe')
+    Favorite = apps.get_model('api', 'Favorite')
+    through = Recipe.users_chose_as_favorite.through
+    through.objects.bulk_create(
+        (
+            through(recipe_id=recipe_id, user_id=user_id)
+            for recipe_id, user_id in Favorite.objects.values_list(
+                'recipe', 'user'
+            ).iterator()
+        ),
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    counts = through.objects.filter(
+        recipe=OuterRef('pk')
+    ).order_by().values('recipe').annotate(total=Count('*')).values('total')
+    Recipe.objects.update(favorites_count=Coalesce(
+        Subquery(counts, output_field=IntegerField()), 0
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_favorites, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='shopinglist',
+            name='user',
+        ),
+        migrations.RemoveField(
+            model_name='shopinglistrecipe',
+            name='recipe',
+        ),
+        migrations.RemoveField(
+            model_name='shopinglistrecipe',
+            name='shoping_list',
+        ),
+        migrations.DeleteModel(
+            name='Favorite',
+        ),
+        migrations.DeleteModel(
+            name='ShopingList',
+        ),
+        migrations.DeleteModel(
+            name='ShopingListRecipe',
+        ),
+    ]
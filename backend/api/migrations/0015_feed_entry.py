@@ -0,0 +1,82 @@
+# Generated by Django 3.2.7 on 2026-10-18 18:32
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q
+import django.db.models.deletion
+
+
+def fill_feeds(apps, schema_editor):
+    Recipe = apps.get_model('api', 'Recipe')
+    FeedEntry = apps.get_model('api', 'FeedEntry')
+    Follow = apps.get_model('users', 'Follow')
+    follows = Follow.objects.filter(
+        following__followers_count__lt=settings.FEED_FANOUT_MAX_FOLLOWERS
+    ).values_list('user', 'following')
+    for user_id, author_id in follows.iterator():
+        FeedEntry.objects.bulk_create(
+            FeedEntry(
+                user_id=user_id,
+                recipe_id=recipe_id,
+                author_id=author_id,
+                pub_date=pub_date,
+            )
+            for recipe_id, pub_date in Recipe.objects.filter(
+                author=author_id
+            ).order_by('-pub_date', '-id').values_list(
+                'id', 'pub_date'
+            )[:settings.FEED_BACKFILL_SIZE]
+        )
+
+    overflowing = FeedEntry.objects.values('user').annotate(
+        total=Count('id')
+    ).filter(total__gt=settings.FEED_MAX_LENGTH).values_list(
+        'user', flat=True
+    )
+    for user_id in list(overflowing):
+        entries = FeedEntry.objects.filter(user=user_id)
+        cutoff = entries.order_by('-pub_date', '-recipe').values(
+            'pub_date', 'recipe'
+        )[settings.FEED_MAX_LENGTH]
+        entries.filter(
+            Q(pub_date__lt=cutoff['pub_date'])
+            | Q(pub_date=cutoff['pub_date'], recipe__lte=cutoff['recipe'])
+        ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0014_merge_favorite_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pub_date', models.DateTimeField()),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='api.recipe')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Feed entry',
+                'verbose_name_plural': 'Feed entries',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='feedentry',
+            index=models.Index(fields=['user', '-pub_date', '-recipe'], name='feed_entry_user_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feedentry',
+            index=models.Index(fields=['user', 'author'], name='feed_entry_user_author_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='feedentry',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_feed_entry'),
+        ),
+        migrations.RunPython(fill_feeds, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 3.2.7 on 2026-10-18 18:34
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+TAG_MASK_BITS = 63
+
+
+def fill_tag_masks(apps, schema_editor):
+    Tag = apps.get_model('api', 'Tag')
+    Recipe = apps.get_model('api', 'Recipe')
+    tags = list(Tag.objects.order_by('id'))
+    if len(tags) > TAG_MASK_BITS:
+        raise RuntimeError(
+            f'No more than {TAG_MASK_BITS} tags are supported'
+        )
+    for bit, tag in enumerate(tags):
+        tag.bit = bit
+    Tag.objects.bulk_update(tags, ['bit'])
+
+    masks = defaultdict(int)
+    for recipe_id, bit in Recipe.tags.through.objects.values_list(
+        'recipe', 'tag__bit'
+    ).iterator():
+        masks[recipe_id] |= 1 << bit
+    Recipe.objects.bulk_update(
+        [
+            Recipe(pk=recipe_id, tag_mask=mask)
+            for recipe_id, mask in masks.items()
+        ],
+        ['tag_mask'],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_feed_entry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='tag_mask',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='bit',
+            field=models.PositiveSmallIntegerField(editable=False, null=True, unique=True),
+        ),
+        migrations.RunPython(fill_tag_masks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.7 on 2026-10-18 18:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_tag_mask'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='contentversion',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
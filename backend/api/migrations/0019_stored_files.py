@@ -0,0 +1,54 @@
+# Generated by Django 3.2.7 on 2026-10-18 18:51
+
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def fill_stored_files(apps, schema_editor):
+    # Files uploaded so far keep their date based names, they are only
+    # counted so that deleting their recipes cleans them up as well.
+    Recipe = apps.get_model('api', 'Recipe')
+    StoredFile = apps.get_model('api', 'StoredFile')
+    references = Counter()
+    recipes = Recipe.objects.values_list('image', 'image_variants')
+    for image, image_variants in recipes.iterator():
+        files = {image} if image else set()
+        for variant, names in image_variants.items():
+            if variant != 'source':
+                files.update(names.values())
+        references.update(files)
+    StoredFile.objects.bulk_create(
+        [
+            StoredFile(name=name, references=count)
+            for name, count in references.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('references', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Stored file',
+                'verbose_name_plural': 'Stored files',
+            },
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(upload_to='recipes/', verbose_name='Image'),
+        ),
+        migrations.RunPython(fill_stored_files, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 3.2.7 on 2026-10-18 19:06
+
+from collections import defaultdict
+
+from django.db import migrations
+
+TAG_MASK_BITS = 63
+
+
+def assign_missing_tag_bits(apps, schema_editor):
+    # Tags loaded with loaddata before bits were assigned on raw saves.
+    Tag = apps.get_model('api', 'Tag')
+    Recipe = apps.get_model('api', 'Recipe')
+    missing = list(Tag.objects.filter(bit__isnull=True).order_by('id'))
+    if not missing:
+        return
+    used = set(Tag.objects.filter(
+        bit__isnull=False
+    ).values_list('bit', flat=True))
+    free = [bit for bit in range(TAG_MASK_BITS) if bit not in used]
+    if len(missing) > len(free):
+        raise RuntimeError(
+            f'No more than {TAG_MASK_BITS} tags are supported'
+        )
+    for tag, bit in zip(missing, free):
+        tag.bit = bit
+    Tag.objects.bulk_update(missing, ['bit'])
+
+    masks = defaultdict(int)
+    for recipe_id, bit in Recipe.tags.through.objects.filter(
+        recipe__tags__in=missing
+    ).values_list('recipe', 'tag__bit').distinct().iterator():
+        masks[recipe_id] |= 1 << bit
+    Recipe.objects.bulk_update(
+        [
+            Recipe(pk=recipe_id, tag_mask=mask)
+            for recipe_id, mask in masks.items()
+        ],
+        ['tag_mask'],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_stored_files'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            assign_missing_tag_bits, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.7 on 2026-10-18 19:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_assign_missing_tag_bits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedfile',
+            name='released_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
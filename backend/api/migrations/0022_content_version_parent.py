@@ -0,0 +1,44 @@
+# Generated by Django 3.2.7 on 2026-10-18 19:28
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def set_recipe_version_parents(apps, schema_editor):
+    # Recipe ETags read the author's version through the parent, so every
+    # recipe needs its version row.
+    Recipe = apps.get_model('api', 'Recipe')
+    ContentVersion = apps.get_model('api', 'ContentVersion')
+    recipes = list(Recipe.objects.values_list('id', 'author'))
+    for start in range(0, len(recipes), BATCH_SIZE):
+        parents = {
+            f'recipe:{recipe_id}': f'user:{author_id}'
+            for recipe_id, author_id in recipes[start:start + BATCH_SIZE]
+        }
+        existing = list(ContentVersion.objects.filter(key__in=parents))
+        for version in existing:
+            version.parent = parents.pop(version.key)
+        ContentVersion.objects.bulk_update(existing, ['parent'])
+        ContentVersion.objects.bulk_create([
+            ContentVersion(key=key, parent=parent)
+            for key, parent in parents.items()
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_storedfile_released_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contentversion',
+            name='parent',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.RunPython(
+            set_recipe_version_parents, migrations.RunPython.noop
+        ),
+    ]
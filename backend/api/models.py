@@ -1,8 +1,12 @@
 from colorfield.fields import ColorField
+from django.contrib.postgres.search import SearchVectorField
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 from django.db import models
 
+from .constants import TAG_MASK_BITS
+
 User = get_user_model()
 
 
@@ -14,6 +18,11 @@ class Ingredient(models.Model):
         ordering = ('name',)
         verbose_name = 'Ingredient'
         verbose_name_plural = 'Ingredients'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient'),
+        ]
 
     def __str__(self):
         return self.name
@@ -26,6 +35,9 @@ class Tag(models.Model):
         unique=True
     )
     slug = models.SlugField(unique=True)
+    bit = models.PositiveSmallIntegerField(
+        unique=True, null=True, editable=False
+    )
 
     class Meta:
         ordering = ('name',)
@@ -35,23 +47,23 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
+    @property
+    def mask(self):
+        # The bit is assigned by a pre_save receiver, unsaved tags have none.
+        return 0 if self.bit is None else 1 << self.bit
 
-class IngredientRecipe(models.Model):
-    ingredient = models.ForeignKey(
-        Ingredient,
-        on_delete=models.CASCADE,
-        related_name='ingredient'
-    )
-    amount = models.PositiveIntegerField()
-
-    def __str__(self):
-        return (f'{self.ingredient} - {self.amount} '
-                f'{self.ingredient.measurement_unit}')
+    def clean(self):
+        if self.bit is None and Tag.objects.filter(
+            bit__isnull=False
+        ).count() >= TAG_MASK_BITS:
+            raise ValidationError(
+                f'No more than {TAG_MASK_BITS} tags are supported'
+            )
 
 
 class Recipe(models.Model):
     name = models.CharField('Title', max_length=200)
-    image = models.ImageField('Image', upload_to=r'recipes/%Y/%m/%d/')
+    image = models.ImageField('Image', upload_to='recipes/')
     text = models.TextField('Description')
     author = models.ForeignKey(
         User,
@@ -60,8 +72,9 @@ class Recipe(models.Model):
     )
     pub_date = models.DateTimeField(auto_now_add=True)
     ingredients = models.ManyToManyField(
-        IngredientRecipe,
-        related_name='ingredients'
+        Ingredient,
+        through='IngredientRecipe',
+        related_name='recipes'
     )
     tags = models.ManyToManyField(Tag, related_name='recipes')
     users_chose_as_favorite = models.ManyToManyField(
@@ -81,67 +94,147 @@ class Recipe(models.Model):
             MinValueValidator(1, message='Minimal value - 1')
         ]
     )
+    search_vector = SearchVectorField(null=True, editable=False)
+    favorites_count = models.PositiveIntegerField(default=0, editable=False)
+    in_carts_count = models.PositiveIntegerField(default=0, editable=False)
+    tag_mask = models.BigIntegerField(default=0, editable=False)
+    image_variants = models.JSONField(default=dict, editable=False)
 
     class Meta:
-        ordering = ('-pub_date',)
+        ordering = ('-pub_date', '-id')
         verbose_name = 'Recipe'
         verbose_name_plural = 'Recipes'
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipe_pub_date_id_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
 
-class Favorite(models.Model):
+class IngredientRecipe(models.Model):
     recipe = models.ForeignKey(
         Recipe,
         on_delete=models.CASCADE,
-        related_name='favorites',
+        related_name='recipe_ingredients'
     )
-    user = models.ForeignKey(
-        User,
+    ingredient = models.ForeignKey(
+        Ingredient,
         on_delete=models.CASCADE,
-        related_name='favorites'
+        related_name='ingredient'
     )
+    amount = models.PositiveIntegerField()
 
     class Meta:
-        verbose_name = 'Favorite'
-        verbose_name_plural = 'Favorites'
         constraints = [
             models.UniqueConstraint(
-                fields=['recipe', 'user'],
-                name='unique_favorite'),
+                fields=['recipe', 'ingredient'],
+                include=['amount'],
+                name='unique_recipe_ingredient'),
         ]
 
     def __str__(self):
-        return f'{self.user} - {self.recipe.name}'
+        return (f'{self.ingredient} - {self.amount} '
+                f'{self.ingredient.measurement_unit}')
 
 
-class ShopingList(models.Model):
-    user = models.OneToOneField(
+class ShoppingCartIngredient(models.Model):
+    """Running ingredient totals of the recipes in a user's cart."""
+    user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
-        related_name='shoping_list'
+        related_name='shopping_cart_ingredients'
     )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_totals'
+    )
+    total_amount = models.PositiveIntegerField()
 
     class Meta:
-        verbose_name = 'Shoping list'
-        verbose_name_plural = 'Shoping lists'
+        verbose_name = 'Shopping cart ingredient'
+        verbose_name_plural = 'Shopping cart ingredients'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_cart_ingredient'),
+        ]
 
     def __str__(self):
-        return f'{str(self.user).title()} shoping list'
+        return f'{self.user}: {self.ingredient} - {self.total_amount}'
 
 
-class ShopingListRecipe(models.Model):
+class FeedEntry(models.Model):
+    """A recipe pushed to the timeline of one of its author's followers."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_entries'
+    )
     recipe = models.ForeignKey(
         Recipe,
         on_delete=models.CASCADE,
-        related_name='list_products'
+        related_name='feed_entries'
     )
-    shoping_list = models.ForeignKey(
-        ShopingList,
+    author = models.ForeignKey(
+        User,
         on_delete=models.CASCADE,
-        related_name='list_products'
+        related_name='+'
     )
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Feed entry'
+        verbose_name_plural = 'Feed entries'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_entry'),
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='feed_entry_user_pub_date_idx'
+            ),
+            models.Index(
+                fields=['user', 'author'],
+                name='feed_entry_user_author_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.recipe}'
+
+
+class ContentVersion(models.Model):
+    """Change counter for a cached resource, bumped on every write."""
+    key = models.CharField(max_length=64, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+    # Key whose version is part of this one, e.g. the author of a recipe.
+    parent = models.CharField(max_length=64, blank=True, default='')
+
+    class Meta:
+        verbose_name = 'Content version'
+        verbose_name_plural = 'Content versions'
+
+    def __str__(self):
+        return f'{self.key} v{self.version}'
+
+
+class StoredFile(models.Model):
+    """Number of recipes referencing a file of the media storage."""
+    name = models.CharField(max_length=100, primary_key=True)
+    references = models.PositiveIntegerField(default=0)
+    released_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        verbose_name = 'Stored file'
+        verbose_name_plural = 'Stored files'
 
     def __str__(self):
-        return f'{self.recipe} in {self.shoping_list}'
+        return f'{self.name} ({self.references})'
@@ -1,7 +1,181 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import heapq
+import json
+from functools import reduce
+from itertools import groupby, islice
+from operator import or_
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Forward-only cursor pagination keyed on ``ordering`` fields.
+
+    The cursor holds the ordering values of the last item of the page, so
+    the next page is a single indexed range scan without OFFSET or COUNT,
+    and rows inserted meanwhile never shift or repeat items.
+    """
+    page_size = 6
+    max_page_size = 999
+    page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    ordering = ('-pub_date', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request, queryset.model)
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(position))
+
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_position_filter(self, position, ordering=None):
+        ordering = ordering or self.ordering
+        conditions = []
+        for index, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = {
+                previous.lstrip('-'): value
+                for previous, value in zip(ordering[:index], position)
+            }
+            conditions.append(
+                Q(**equal, **{f'{name}__{lookup}': position[index]})
+            )
+        return reduce(or_, conditions)
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+        except (binascii.Error, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or (
+            len(position) != len(self.ordering)
+        ):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            return [
+                self.parse_position_value(model, field, value)
+                for field, value in zip(self.ordering, position)
+            ]
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def parse_position_value(model, field, value):
+        value = model._meta.get_field(field.lstrip('-')).to_python(value)
+        if value is None:
+            raise ValueError('Cursor values must not be null')
+        return value
+
+    def get_position(self, item):
+        return [getattr(item, field.lstrip('-')) for field in self.ordering]
+
+    def encode_cursor(self, item):
+        position = []
+        for value in self.get_position(item):
+            if hasattr(value, 'isoformat'):
+                value = value.isoformat()
+            position.append(value)
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.page[-1])
+        )
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': None,
+            'results': data,
+        })
+
+
+class MergedKeysetPagination(KeysetPagination):
+    """Keyset pagination over the union of several ordered sources.
+
+    Every source is a ``(queryset, id field)`` pair sorted by the
+    descending ``ordering``, with the id field in place of ``id``. A page
+    reads at most ``page_size + 1`` rows from each source with its own
+    range scan and merges them. Page items are ``(pub_date, id)`` pairs.
+    """
+
+    def paginate_sources(self, sources, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        position = self.decode_cursor(request, sources[0][0].model)
+        scans = []
+        for queryset, id_field in sources:
+            ordering = (*self.ordering[:-1], f'-{id_field}')
+            queryset = queryset.order_by(*ordering)
+            if position is not None:
+                queryset = queryset.filter(
+                    self.get_position_filter(position, ordering)
+                )
+            scans.append(queryset.values_list(
+                *(field.lstrip('-') for field in ordering)
+            )[:self.page_size + 1])
+
+        # Sources may overlap, equal rows are adjacent once merged.
+        merged = heapq.merge(*scans, reverse=True)
+        merged = (row for row, _ in groupby(merged))
+        results = list(islice(merged, self.page_size + 1))
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return [row[-1] for row in self.page]
+
+    def get_position(self, item):
+        return list(item)
 
 
 class DefaultPagination(PageNumberPagination):
+    """Page number pagination with opt-in keyset mode.
+
+    Passing the ``cursor`` query parameter (empty for the first page)
+    switches the response to ``keyset_pagination_class``.
+    """
     page_size = 6
     max_page_size = 999
     page_size_query_param = 'limit'
+    keyset_pagination_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        cursor_param = self.keyset_pagination_class.cursor_query_param
+        if cursor_param in request.query_params:
+            self.keyset = self.keyset_pagination_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection
+from django.db.models import Case, F, FloatField, Q, Value, When
+
+from .models import Recipe
+
+
+def get_search_vector():
+    config = settings.RECIPE_SEARCH_CONFIG
+    return (
+        SearchVector('name', weight='A', config=config)
+        + SearchVector('text', weight='B', config=config)
+    )
+
+
+def update_search_vector(recipe_ids):
+    if connection.vendor != 'postgresql':
+        return
+    Recipe.objects.filter(pk__in=recipe_ids).update(
+        search_vector=get_search_vector()
+    )
+
+
+def search_recipes(queryset, value):
+    """Filter recipes matching ``value`` and order them by relevance.
+
+    PostgreSQL uses the stored, GIN-indexed ``search_vector``; other
+    databases fall back to a name/text substring match.
+    """
+    if connection.vendor == 'postgresql':
+        query = SearchQuery(
+            value,
+            config=settings.RECIPE_SEARCH_CONFIG,
+            search_type='websearch',
+        )
+        return queryset.filter(search_vector=query).annotate(
+            rank=SearchRank(F('search_vector'), query)
+        ).order_by('-rank', '-pub_date', '-id')
+
+    return queryset.filter(
+        Q(name__icontains=value) | Q(text__icontains=value)
+    ).annotate(
+        rank=Case(
+            When(name__icontains=value, then=Value(1.0)),
+            default=Value(0.4),
+            output_field=FloatField(),
+        )
+    ).order_by('-rank', '-pub_date', '-id')
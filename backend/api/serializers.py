@@ -1,15 +1,58 @@
+import uuid
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from django.http import QueryDict
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 
 from users.serializers import UserRecipeSerializer
+from .images import get_variant_urls
+from .memberships import get_memberships
 from .models import Ingredient, IngredientRecipe, Recipe, Tag
+from .shopping_cart import (apply_cart_delta, get_amounts_delta,
+                            get_cart_user_ids)
+from .uploads import get_form_data, open_image_header
+
+
+class RecipeImageField(Base64ImageField):
+    """Accept an image as a base64 string or as a multipart file.
+
+    Uploaded files are only checked from their header: the body was
+    streamed to disk by ``RecipeImageUploadHandler`` and is never decoded
+    here.
+    """
+
+    def to_internal_value(self, data):
+        if not isinstance(data, UploadedFile):
+            return super().to_internal_value(data)
+        file = serializers.FileField.to_internal_value(self, data)
+        try:
+            image = open_image_header(file)
+        except ValueError as error:
+            raise serializers.ValidationError(str(error))
+        finally:
+            file.seek(0)
+        if image is None:
+            raise serializers.ValidationError(self.INVALID_FILE_MESSAGE)
+        file.name = '{}.{}'.format(
+            uuid.uuid4(), 'jpg' if image.format == 'JPEG'
+            else image.format.lower()
+        )
+        return file
 
 
 class TagSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Tag
-        fields = '__all__'
+        fields = (
+            'id',
+            'name',
+            'color',
+            'slug'
+        )
 
 
 class IngredientListSerializer(serializers.ModelSerializer):
@@ -24,9 +67,11 @@ class IngredientListSerializer(serializers.ModelSerializer):
 
 
 class IngredientRecipeSerializer(serializers.ModelSerializer):
-    id = serializers.SerializerMethodField(read_only=True)
-    name = serializers.SerializerMethodField(read_only=True)
-    measurement_unit = serializers.SerializerMethodField(read_only=True)
+    id = serializers.ReadOnlyField(source='ingredient.id')
+    name = serializers.ReadOnlyField(source='ingredient.name')
+    measurement_unit = serializers.ReadOnlyField(
+        source='ingredient.measurement_unit'
+    )
 
     class Meta:
         model = IngredientRecipe
@@ -37,18 +82,9 @@ class IngredientRecipeSerializer(serializers.ModelSerializer):
             'amount'
         )
 
-    def get_id(self, ingredient_object):
-        return ingredient_object.ingredient.id
-
-    def get_name(self, ingredient_object):
-        return ingredient_object.ingredient.name
-
-    def get_measurement_unit(self, ingredient_object):
-        return ingredient_object.ingredient.measurement_unit
-
 
 class IngredientRecipeCreateSerializer(serializers.ModelSerializer):
-    id = serializers.IntegerField()
+    id = serializers.IntegerField(source='ingredient_id')
 
     class Meta:
         model = IngredientRecipe
@@ -60,8 +96,11 @@ class IngredientRecipeCreateSerializer(serializers.ModelSerializer):
 
 class RecipeSerializer(serializers.ModelSerializer):
     tags = TagSerializer(read_only=True, many=True)
-    ingredients = IngredientRecipeSerializer(read_only=True, many=True)
+    ingredients = IngredientRecipeSerializer(
+        source='recipe_ingredients', read_only=True, many=True
+    )
     image = Base64ImageField()
+    images = serializers.SerializerMethodField(read_only=True)
     author = UserRecipeSerializer(read_only=True)
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
@@ -77,21 +116,24 @@ class RecipeSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'images',
             'text',
             'cooking_time'
         )
 
+    def get_images(self, recipe):
+        return get_variant_urls(recipe, self.context.get('request'))
+
     def get_is_favorited(self, recipe):
-        user = self.context["request"].user
-        return recipe.users_chose_as_favorite.filter(id=user.id).exists()
+        return recipe.pk in get_memberships(self.context['request']).favorites
 
     def get_is_in_shopping_cart(self, recipe):
-        user = self.context["request"].user
-        return recipe.users_put_in_cart.filter(id=user.id).exists()
+        return recipe.pk in get_memberships(self.context['request']).cart
 
 
 class RecipeListSerializer(serializers.ModelSerializer):
     image = Base64ImageField()
+    images = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Recipe
@@ -99,17 +141,34 @@ class RecipeListSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'images',
             'cooking_time'
         )
 
+    def get_images(self, recipe):
+        return get_variant_urls(recipe, self.context.get('request'))
+
+
+class RecipeBatchSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.RECIPE_BATCH_MAX_SIZE,
+    )
+
+    def validate_ids(self, ids):
+        return list(dict.fromkeys(ids))
+
 
 class RecipeCreateSerializer(serializers.ModelSerializer):
-    ingredients = IngredientRecipeCreateSerializer(many=True)
+    ingredients = IngredientRecipeCreateSerializer(
+        source='recipe_ingredients', many=True
+    )
     tags = serializers.PrimaryKeyRelatedField(
         many=True,
         queryset=Tag.objects.all()
     )
-    image = Base64ImageField()
+    image = RecipeImageField()
 
     class Meta:
         model = Recipe
@@ -122,30 +181,82 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             'cooking_time'
         )
 
+    def to_internal_value(self, data):
+        if isinstance(data, QueryDict):
+            data = get_form_data(data)
+        return super().to_internal_value(data)
+
+    def validate_ingredients(self, ingredients_):
+        ingredient_ids = {item['ingredient_id'] for item in ingredients_}
+        if len(ingredient_ids) != len(ingredients_):
+            raise serializers.ValidationError(
+                'Ingredients must not repeat'
+            )
+        if Ingredient.objects.filter(
+            id__in=ingredient_ids
+        ).count() != len(ingredient_ids):
+            raise serializers.ValidationError('Unknown ingredient')
+        return ingredients_
+
+    @staticmethod
+    def create_ingredients(recipe, amounts):
+        IngredientRecipe.objects.bulk_create([
+            IngredientRecipe(
+                recipe=recipe, ingredient_id=ingredient_id, amount=amount
+            )
+            for ingredient_id, amount in amounts.items()
+        ])
+
+    @transaction.atomic
     def create(self, validated_data):
-        ingredients_ = validated_data.pop('ingredients')
+        ingredients_ = validated_data.pop('recipe_ingredients')
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
-        for item in ingredients_:
-            ingredient, created = IngredientRecipe.objects.get_or_create(
-                ingredient_id=item['id'],
-                amount=item['amount']
-            )
-            recipe.ingredients.add(ingredient)
+        self.create_ingredients(recipe, {
+            item['ingredient_id']: item['amount'] for item in ingredients_
+        })
         recipe.tags.add(*tags)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        instance.ingredients.clear()
-        instance.tags.clear()
-        ingredients_ = validated_data.pop('ingredients')
-        tags = validated_data.pop('tags')
+        ingredients_ = validated_data.pop('recipe_ingredients', None)
+        tags = validated_data.pop('tags', None)
         recipe = super().update(instance, validated_data)
-        for item in ingredients_:
-            ingredient, created = IngredientRecipe.objects.get_or_create(
-                ingredient_id=item['id'],
-                amount=item['amount']
-            )
-            recipe.ingredients.add(ingredient)
-        recipe.tags.add(*tags)
+        if tags is not None:
+            recipe.tags.set(tags)
+        if ingredients_ is None:
+            return recipe
+
+        rows = {
+            row.ingredient_id: row
+            for row in recipe.recipe_ingredients.all()
+        }
+        old_amounts = {
+            ingredient_id: row.amount for ingredient_id, row in rows.items()
+        }
+        new_amounts = {
+            item['ingredient_id']: item['amount'] for item in ingredients_
+        }
+        removed = old_amounts.keys() - new_amounts.keys()
+        if removed:
+            recipe.recipe_ingredients.filter(
+                ingredient_id__in=removed
+            ).delete()
+        changed = []
+        for ingredient_id, amount in new_amounts.items():
+            row = rows.get(ingredient_id)
+            if row is not None and row.amount != amount:
+                row.amount = amount
+                changed.append(row)
+        IngredientRecipe.objects.bulk_update(changed, ['amount'])
+        self.create_ingredients(recipe, {
+            ingredient_id: amount
+            for ingredient_id, amount in new_amounts.items()
+            if ingredient_id not in rows
+        })
+        apply_cart_delta(
+            get_cart_user_ids(recipe),
+            get_amounts_delta(old_amounts, new_amounts)
+        )
         return recipe
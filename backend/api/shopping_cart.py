@@ -0,0 +1,146 @@
+from django.db import connection
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.db.models.functions import Greatest
+
+from .models import IngredientRecipe, Recipe, ShoppingCartIngredient
+
+CART_UPSERT_BATCH_SIZE = 500
+
+
+def get_recipe_amounts(recipe):
+    """Return ``{ingredient_id: amount}`` summed over the recipe."""
+    return dict(
+        IngredientRecipe.objects.filter(
+            recipe=recipe
+        ).values_list('ingredient', 'amount')
+    )
+
+
+def get_recipes_amounts(recipe_ids):
+    """Return ``{ingredient_id: amount}`` summed over several recipes."""
+    return dict(
+        IngredientRecipe.objects.filter(
+            recipe__in=recipe_ids
+        ).order_by().values_list('ingredient').annotate(Sum('amount'))
+    )
+
+
+def get_amounts_delta(old_amounts, new_amounts):
+    return {
+        ingredient_id: (
+            new_amounts.get(ingredient_id, 0)
+            - old_amounts.get(ingredient_id, 0)
+        )
+        for ingredient_id in old_amounts.keys() | new_amounts.keys()
+    }
+
+
+def get_cart_user_ids(recipe):
+    return list(recipe.users_put_in_cart.values_list('id', flat=True))
+
+
+def get_cart_table():
+    quote = connection.ops.quote_name
+    meta = ShoppingCartIngredient._meta
+    return (
+        quote(meta.db_table),
+        quote(meta.get_field('user').column),
+        quote(meta.get_field('ingredient').column),
+        quote(meta.get_field('total_amount').column),
+    )
+
+
+def add_cart_amounts(user_ids, amounts):
+    """Upsert positive amounts, one statement per batch of rows.
+
+    ``ON CONFLICT`` on the unique (user, ingredient) constraint lets two
+    requests adding the same new ingredient both succeed.
+    """
+    table, user_column, ingredient_column, total_column = get_cart_table()
+    rows = [
+        (user_id, ingredient_id, amount)
+        for user_id in user_ids
+        for ingredient_id, amount in amounts.items()
+    ]
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), CART_UPSERT_BATCH_SIZE):
+            batch = rows[start:start + CART_UPSERT_BATCH_SIZE]
+            values = ', '.join(['(%s, %s, %s)'] * len(batch))
+            cursor.execute(
+                f'INSERT INTO {table} '
+                f'({user_column}, {ingredient_column}, {total_column}) '
+                f'VALUES {values} '
+                f'ON CONFLICT ({user_column}, {ingredient_column}) '
+                f'DO UPDATE SET {total_column} = '
+                f'{table}.{total_column} + EXCLUDED.{total_column}',
+                [param for row in batch for param in row],
+            )
+
+
+def subtract_cart_amounts(user_ids, amounts):
+    rows = ShoppingCartIngredient.objects.filter(
+        user__in=user_ids, ingredient__in=amounts
+    )
+    rows.update(total_amount=Greatest(
+        F('total_amount') - Case(
+            *[
+                When(ingredient_id=ingredient_id, then=Value(amount))
+                for ingredient_id, amount in amounts.items()
+            ],
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    ))
+    rows.filter(total_amount=0).delete()
+
+
+def apply_cart_delta(user_ids, delta):
+    """Add ``delta`` amounts to the cart totals of every user in user_ids.
+
+    Rows dropping to zero are deleted.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    added = {
+        ingredient_id: amount
+        for ingredient_id, amount in delta.items() if amount > 0
+    }
+    removed = {
+        ingredient_id: -amount
+        for ingredient_id, amount in delta.items() if amount < 0
+    }
+    if added:
+        add_cart_amounts(user_ids, added)
+    if removed:
+        subtract_cart_amounts(user_ids, removed)
+
+
+def add_recipes_to_cart(user, recipe_ids):
+    apply_cart_delta([user.id], get_recipes_amounts(recipe_ids))
+
+
+def remove_recipes_from_cart(user, recipe_ids):
+    apply_cart_delta(
+        [user.id], get_amounts_delta(get_recipes_amounts(recipe_ids), {})
+    )
+
+
+def remove_recipe_from_all_carts(recipe):
+    apply_cart_delta(
+        get_cart_user_ids(recipe),
+        get_amounts_delta(get_recipe_amounts(recipe), {})
+    )
+
+
+def get_source_totals():
+    """Compute ``{(user_id, ingredient_id): total}`` from the cart itself."""
+    cart = Recipe.users_put_in_cart.through.objects.filter(
+        recipe__recipe_ingredients__isnull=False
+    )
+    return {
+        (user_id, ingredient_id): total
+        for user_id, ingredient_id, total in cart.values_list(
+            'user', 'recipe__recipe_ingredients__ingredient'
+        ).annotate(Sum('recipe__recipe_ingredients__amount'))
+    }
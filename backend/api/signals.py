@@ -0,0 +1,230 @@
+import logging
+
+from django.contrib.auth import get_user_model
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from users.models import Follow
+from .autocomplete import ingredient_index
+from .cache import invalidate_all_recipe_lists, invalidate_recipe_lists
+from .counters import change_counter
+from .images import (generate_variants, get_existing_variants,
+                     needs_variants)
+from .media import get_recipe_files, remove_references, update_references
+from .models import Ingredient, Recipe, Tag
+from .search import update_search_vector
+from .shopping_cart import remove_recipe_from_all_carts
+from .tag_masks import clear_tag_bit, get_free_tag_bit, update_tag_masks
+from .versions import (INGREDIENTS_VERSION, TAGS_VERSION,
+                       USER_PROFILE_FIELDS, bump_version,
+                       recipe_content_version_key, recipe_version_key,
+                       user_content_version_key, user_version_key)
+
+User = get_user_model()
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    ingredient_index.invalidate()
+
+
+@receiver(post_save, sender=Recipe)
+def generate_recipe_image_variants(sender, instance, **kwargs):
+    # Connected before the version and cache receivers below, so they
+    # already see the stored variants.
+    if not needs_variants(instance):
+        return
+    try:
+        instance.image_variants = (
+            get_existing_variants(instance.image.name)
+            or generate_variants(instance.image.name)
+        )
+    except (OSError, ValueError):
+        # A truncated or missing image must not fail the write: the
+        # recipe is served with its original image until
+        # generate_image_variants succeeds.
+        logger.warning(
+            'Image variants of recipe %s failed', instance.pk, exc_info=True
+        )
+        instance.image_variants = {}
+    Recipe.objects.filter(pk=instance.pk).update(
+        image_variants=instance.image_variants
+    )
+
+
+@receiver(pre_save, sender=Recipe)
+def remember_recipe_files(sender, instance, **kwargs):
+    instance._stored_files = set()
+    if instance.pk is None:
+        return
+    stored = Recipe.objects.filter(pk=instance.pk).only(
+        'image', 'image_variants'
+    ).first()
+    if stored is not None:
+        instance._stored_files = get_recipe_files(stored)
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_file_references(sender, instance, **kwargs):
+    # Connected after the variants receiver, so the new variants are
+    # counted along with the image.
+    files = get_recipe_files(instance)
+    update_references(instance._stored_files, files)
+    instance._stored_files = files
+
+
+@receiver(post_delete, sender=Recipe)
+def release_recipe_files(sender, instance, **kwargs):
+    remove_references(get_recipe_files(instance))
+
+
+@receiver(post_save, sender=Recipe)
+def count_created_recipe(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        change_counter(User, instance.author_id, 'recipes_count', 1)
+
+
+@receiver(pre_delete, sender=Recipe)
+def release_deleted_recipe(sender, instance, **kwargs):
+    # Also runs for admin deletes and for the recipes of a deleted author.
+    remove_recipe_from_all_carts(instance)
+    change_counter(User, instance.author_id, 'recipes_count', -1)
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search_vector(sender, instance, update_fields=None,
+                                **kwargs):
+    if update_fields and not {'name', 'text'} & set(update_fields):
+        return
+    update_search_vector([instance.pk])
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def bump_ingredients_version(sender, **kwargs):
+    bump_version(INGREDIENTS_VERSION)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def bump_tags_version(sender, **kwargs):
+    bump_version(TAGS_VERSION)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def bump_recipe_version(sender, instance, **kwargs):
+    # The author's version is the parent, so the ETag of a recipe never
+    # needs the recipe row.
+    bump_version(
+        recipe_version_key(instance.pk),
+        parent=user_version_key(instance.author_id),
+    )
+    bump_version(recipe_content_version_key(instance.pk))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.users_chose_as_favorite.through)
+@receiver(m2m_changed, sender=Recipe.users_put_in_cart.through)
+def bump_recipe_relations_version(sender, instance, action, reverse,
+                                  pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        recipe_ids = [instance.pk]
+    elif pk_set:
+        recipe_ids = list(pk_set)
+    else:
+        return
+    # Favorites and carts only change what the ETag covers, not the
+    # cached recipe fragments.
+    keys = [recipe_version_key(pk) for pk in recipe_ids]
+    if sender is Recipe.tags.through:
+        keys += [recipe_content_version_key(pk) for pk in recipe_ids]
+    bump_version(*keys)
+
+
+@receiver(post_save, sender=User)
+def bump_user_version(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    keys = [user_version_key(instance.pk)]
+    if not update_fields or set(update_fields) & set(USER_PROFILE_FIELDS):
+        keys.append(user_content_version_key(instance.pk))
+    bump_version(*keys)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def bump_following_version(sender, instance, **kwargs):
+    bump_version(user_version_key(instance.following_id))
+
+
+@receiver(pre_save, sender=Tag)
+def assign_tag_bit(sender, instance, **kwargs):
+    # Also runs for raw saves, so tags loaded from fixtures get a bit.
+    if instance.bit is None:
+        instance.bit = get_free_tag_bit()
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def update_recipe_tag_masks(sender, instance, action, reverse, pk_set,
+                            **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            update_tag_masks([instance.pk])
+    elif action in ('post_add', 'post_remove') and pk_set:
+        update_tag_masks(list(pk_set))
+    elif action == 'post_clear':
+        clear_tag_bit(instance.bit)
+
+
+@receiver(post_delete, sender=Tag)
+def clear_deleted_tag_bit(sender, instance, **kwargs):
+    clear_tag_bit(instance.bit)
+
+
+def get_tag_slugs(recipe):
+    return list(recipe.tags.values_list('slug', flat=True))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(pre_delete, sender=Recipe)
+def invalidate_recipe_list_pages(sender, instance, **kwargs):
+    invalidate_recipe_lists(instance.author_id, get_tag_slugs(instance))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_tag_pages(sender, instance, action, reverse, pk_set,
+                                **kwargs):
+    if reverse:
+        if action in ('post_add', 'post_remove', 'pre_clear'):
+            invalidate_all_recipe_lists()
+        return
+    if action == 'pre_clear':
+        invalidate_recipe_lists(instance.author_id, get_tag_slugs(instance))
+    elif action in ('post_add', 'post_remove'):
+        invalidate_recipe_lists(
+            instance.author_id,
+            Tag.objects.filter(pk__in=pk_set).values_list('slug', flat=True),
+        )
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_all_recipe_list_pages(sender, **kwargs):
+    invalidate_all_recipe_lists()
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_recipe_pages(sender, instance, update_fields=None,
+                                   **kwargs):
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    if instance.recipes.exists():
+        invalidate_all_recipe_lists()
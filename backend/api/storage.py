@@ -0,0 +1,45 @@
+import hashlib
+import posixpath
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+from .media import claim_file
+
+HASH_PREFIX_LENGTH = 2
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage naming every file by the hash of its content.
+
+    ``recipes/photo.jpg`` is stored as ``recipes/ab/<sha256>.jpg``: saving
+    the same content twice returns the existing name without writing, and
+    a name never points at different content, so the files can be cached
+    forever. Deleting files still referenced elsewhere is left to
+    ``api.media``, which the storage tells about every reused file.
+    """
+
+    def get_content_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        content_hash = digest.hexdigest()
+        directory, filename = posixpath.split(name)
+        _, extension = posixpath.splitext(filename)
+        return posixpath.join(
+            directory,
+            content_hash[:HASH_PREFIX_LENGTH],
+            content_hash + extension.lower(),
+        )
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.get_content_name(name, content)
+        claim_file(name)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
@@ -0,0 +1,63 @@
+from collections import defaultdict
+
+from django.db.models import F
+
+from .constants import TAG_MASK_BITS
+from .models import Recipe, Tag
+
+
+def get_free_tag_bit():
+    used = set(Tag.objects.filter(
+        bit__isnull=False
+    ).values_list('bit', flat=True))
+    for bit in range(TAG_MASK_BITS):
+        if bit not in used:
+            return bit
+    raise ValueError(f'No more than {TAG_MASK_BITS} tags are supported')
+
+
+def get_tags_mask(tags):
+    mask = 0
+    for tag in tags:
+        mask |= tag.mask
+    return mask
+
+
+def filter_by_tags_mask(queryset, mask, match_all=False):
+    """Match recipes having all or any of the ``mask`` tags.
+
+    The condition is a single predicate on the recipe row, so the tag
+    tables are not joined and no DISTINCT is needed.
+    """
+    queryset = queryset.alias(tags_matched=F('tag_mask').bitand(mask))
+    if match_all:
+        return queryset.filter(tags_matched=mask)
+    return queryset.exclude(tags_matched=0)
+
+
+def update_tag_masks(recipe_ids):
+    """Recompute ``tag_mask`` of the given recipes from their tags."""
+    masks = defaultdict(int)
+    for recipe_id, bit in Recipe.tags.through.objects.filter(
+        recipe__in=recipe_ids, tag__bit__isnull=False
+    ).values_list('recipe', 'tag__bit'):
+        masks[recipe_id] |= 1 << bit
+    Recipe.objects.bulk_update(
+        [
+            Recipe(pk=recipe_id, tag_mask=masks[recipe_id])
+            for recipe_id in recipe_ids
+        ],
+        ['tag_mask'],
+        batch_size=1000,
+    )
+
+
+def clear_tag_bit(bit):
+    """Remove the bit of a deleted tag from every recipe carrying it."""
+    if bit is None:
+        return
+    Recipe.objects.alias(
+        tags_matched=F('tag_mask').bitand(1 << bit)
+    ).exclude(tags_matched=0).update(
+        tag_mask=F('tag_mask').bitand(~(1 << bit))
+    )
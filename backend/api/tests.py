@@ -0,0 +1,835 @@
+import base64
+import random
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APITestCase
+
+from users.models import Follow, User
+from .cache import RECIPES_ALL_GENERATION, invalidate_all_recipe_lists
+from .cookable import RecipeIngredientIndex, rank_cookable_recipes_in_db
+from .feed import backfill_feed
+from .fragments import build_fragments
+from .media import delete_unused_files, get_recipe_files
+from .memberships import FAVORITES, Memberships, load_membership
+from .models import (FeedEntry, Ingredient, IngredientRecipe, Recipe,
+                     ShoppingCartIngredient, StoredFile, Tag)
+from .shopping_cart import get_source_totals
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+# A 1x1 PNG.
+IMAGE = (
+    b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01'
+    b'\x08\x02\x00\x00\x00\x90wS\xde\x00\x00\x00\x0cIDATx\x9cc\xf8\xcf\xc0'
+    b'\x00\x00\x03\x01\x01\x00\xc9\xfe\x92\xef\x00\x00\x00\x00IEND\xaeB`\x82'
+)
+
+RECIPES_COUNT = 10
+INGREDIENTS_PER_RECIPE = 5
+
+# Page count, page ids, authors, content versions, then the recipes, their
+# tags and their ingredients when the fragments are not cached yet.
+LIST_QUERIES = 4
+FRAGMENT_QUERIES = 3
+# Followed authors, favorites and cart of the viewer, cached afterwards.
+MEMBERSHIP_QUERIES = 3
+# Versions for the ETag, author and versions of the fragment.
+RETRIEVE_QUERIES = 3
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class RecipeTestCase(APITestCase):
+    """Recipes of one author, the last one favorited and in the cart of a
+    viewer following that author.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass',
+            first_name='Author', last_name='Author',
+        )
+        cls.viewer = User.objects.create_user(
+            username='viewer', email='viewer@example.com', password='pass',
+            first_name='Viewer', last_name='Viewer',
+        )
+        cls.tags = tags = [
+            Tag.objects.create(name=f'Tag {i}', slug=f'tag-{i}',
+                               color=f'#00000{i}')
+            for i in range(3)
+        ]
+        cls.ingredients = ingredients = [
+            Ingredient.objects.create(
+                name=f'Ingredient {i}', measurement_unit='g'
+            )
+            for i in range(INGREDIENTS_PER_RECIPE * 2)
+        ]
+        for i in range(RECIPES_COUNT):
+            recipe = Recipe.objects.create(
+                author=cls.author,
+                name=f'Recipe {i}',
+                text='Text',
+                cooking_time=10,
+                image=SimpleUploadedFile('recipe.png', IMAGE),
+            )
+            recipe.tags.set(tags[:i % 3 + 1])
+            IngredientRecipe.objects.bulk_create([
+                IngredientRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=i + 1
+                )
+                for ingredient in ingredients[i % 2::2]
+            ])
+        cls.recipe = recipe
+        recipe.users_chose_as_favorite.add(cls.viewer)
+        recipe.users_put_in_cart.add(cls.viewer)
+        Follow.objects.create(user=cls.viewer, following=cls.author)
+        call_command('recount', stdout=StringIO())
+        call_command('rebuild_shopping_cart', stdout=StringIO())
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def get_ids(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.data['results']]
+
+
+class RecipeQueryCountTests(RecipeTestCase):
+    """Pin the number of queries of the recipe list and detail.
+
+    The count must not depend on the page size, only on whether the
+    recipe fragments and the viewer's memberships are cached yet.
+    """
+
+    def get(self, url, queries):
+        with self.assertNumQueries(queries):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def assert_list_queries(self, limit, cold, warm):
+        url = f'/api/recipes/?limit={limit}'
+        response = self.get(url, cold)
+        self.assertEqual(
+            len(response.data['results']), min(limit, RECIPES_COUNT)
+        )
+        self.assertEqual(response.data['count'], RECIPES_COUNT)
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate_all_recipe_lists()
+        self.assertEqual(self.get(url, warm).data, response.data)
+
+    def test_list_anonymous(self):
+        for limit in (6, 999):
+            with self.subTest(limit=limit):
+                cache.clear()
+                self.assert_list_queries(
+                    limit, LIST_QUERIES + FRAGMENT_QUERIES, LIST_QUERIES
+                )
+
+    def test_list_anonymous_page_cache(self):
+        self.get('/api/recipes/?limit=6', LIST_QUERIES + FRAGMENT_QUERIES)
+        self.get('/api/recipes/?limit=6', 0)
+
+    def test_list_authenticated(self):
+        self.client.force_authenticate(self.viewer)
+        for limit in (6, 999):
+            with self.subTest(limit=limit):
+                cache.clear()
+                self.assert_list_queries(
+                    limit,
+                    LIST_QUERIES + FRAGMENT_QUERIES + MEMBERSHIP_QUERIES,
+                    LIST_QUERIES,
+                )
+        data = self.client.get('/api/recipes/?limit=999').data['results']
+        flags = {
+            item['id']: (
+                item['is_favorited'],
+                item['is_in_shopping_cart'],
+                item['author']['is_subscribed'],
+            )
+            for item in data
+        }
+        self.assertEqual(flags.pop(self.recipe.pk), (True, True, True))
+        self.assertEqual(set(flags.values()), {(False, False, True)})
+
+    def test_retrieve(self):
+        url = f'/api/recipes/{self.recipe.pk}/'
+        response = self.get(url, RETRIEVE_QUERIES + FRAGMENT_QUERIES)
+        self.assertFalse(response.data['is_favorited'])
+        self.assertEqual(
+            len(response.data['ingredients']), INGREDIENTS_PER_RECIPE
+        )
+        self.get(url, RETRIEVE_QUERIES)
+
+        self.client.force_authenticate(self.viewer)
+        cache.clear()
+        response = self.get(
+            url, RETRIEVE_QUERIES + FRAGMENT_QUERIES + MEMBERSHIP_QUERIES
+        )
+        self.assertTrue(response.data['is_favorited'])
+        self.assertTrue(response.data['author']['is_subscribed'])
+        self.get(url, RETRIEVE_QUERIES)
+
+
+class ConditionalRequestTests(RecipeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.url = f'/api/recipes/{self.recipe.pk}/'
+
+    def get_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def assert_not_modified(self, etag):
+        # Answered from the content versions alone.
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def assert_modified(self, etag):
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return response
+
+    def test_author_change_after_not_modified(self):
+        etag = self.get_etag()
+        self.assert_not_modified(etag)
+        self.author.first_name = 'Renamed'
+        self.author.save()
+        response = self.assert_modified(etag)
+        self.assertEqual(response.data['author']['first_name'], 'Renamed')
+        self.assert_not_modified(response['ETag'])
+
+    def test_tag_and_recipe_changes_after_not_modified(self):
+        etag = self.get_etag()
+        tag = self.recipe.tags.first()
+        tag.name = 'Renamed'
+        tag.save()
+        etag = self.assert_modified(etag)['ETag']
+        self.assert_not_modified(etag)
+        self.recipe.tags.remove(tag)
+        etag = self.assert_modified(etag)['ETag']
+        self.recipe.name = 'Renamed'
+        self.recipe.save()
+        self.assertEqual(self.assert_modified(etag).data['name'], 'Renamed')
+
+    def test_viewer_favorite_after_not_modified(self):
+        self.client.force_authenticate(self.viewer)
+        etag = self.get_etag()
+        self.assert_not_modified(etag)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'{self.url}favorite/')
+        response = self.assert_modified(etag)
+        self.assertFalse(response.data['is_favorited'])
+
+    def test_new_recipe_has_author_parent(self):
+        self.client.force_authenticate(self.author)
+        recipe = Recipe.objects.create(
+            author=self.author, name='New', text='Text', cooking_time=1,
+            image=SimpleUploadedFile('recipe.png', IMAGE),
+        )
+        self.url = f'/api/recipes/{recipe.pk}/'
+        etag = self.get_etag()
+        self.author.last_name = 'Renamed'
+        self.author.save()
+        self.assert_modified(etag)
+
+
+class IngredientViewTests(RecipeTestCase):
+
+    def test_autocomplete_runs_no_query_once_indexed(self):
+        url = '/api/ingredients/autocomplete/?name=ingredient 1'
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(
+            [item['name'] for item in response.data], ['Ingredient 1']
+        )
+        with self.assertNumQueries(0):
+            self.client.get('/api/ingredients/?name=ingr')
+
+    def test_autocomplete_sees_new_ingredients(self):
+        url = '/api/ingredients/autocomplete/?name=salt'
+        self.assertEqual(self.client.get(url).data, [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='Salt', measurement_unit='g')
+        self.assertEqual(
+            [item['name'] for item in self.client.get(url).data], ['Salt']
+        )
+
+    def test_list_not_modified(self):
+        response = self.client.get('/api/ingredients/')
+        with self.assertNumQueries(1):
+            not_modified = self.client.get(
+                '/api/ingredients/', HTTP_IF_NONE_MATCH=response['ETag']
+            )
+        self.assertEqual(not_modified.status_code, 304)
+        Ingredient.objects.create(name='Pepper', measurement_unit='g')
+        self.assertEqual(
+            self.client.get(
+                '/api/ingredients/', HTTP_IF_NONE_MATCH=response['ETag']
+            ).status_code,
+            200,
+        )
+
+
+class RecipeListCacheTests(RecipeTestCase):
+
+    def get_names(self, url='/api/recipes/?limit=999'):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return {item['id']: item['name'] for item in response.data['results']}
+
+    def test_write_invalidates_pages_once_committed(self):
+        self.assertEqual(self.get_names()[self.recipe.pk], self.recipe.name)
+        generation = cache.get(RECIPES_ALL_GENERATION)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.name = 'Renamed'
+            self.recipe.save()
+            # Not committed yet: a page built now would hold the old rows,
+            # so the generation must not move before the commit.
+            self.assertEqual(cache.get(RECIPES_ALL_GENERATION), generation)
+        self.assertNotEqual(cache.get(RECIPES_ALL_GENERATION), generation)
+        self.assertEqual(self.get_names()[self.recipe.pk], 'Renamed')
+
+    def test_tag_and_delete_invalidate_filtered_pages(self):
+        tag = self.tags[2]
+        url = f'/api/recipes/?limit=999&tags={tag.slug}'
+        tagged = self.get_names(url)
+        recipe = Recipe.objects.exclude(pk__in=tagged).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.tags.add(tag)
+        self.assertIn(recipe.pk, self.get_names(url))
+
+        self.client.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/recipes/{recipe.pk}/')
+        self.client.force_authenticate(None)
+        self.assertNotIn(recipe.pk, self.get_names(url))
+        self.assertNotIn(recipe.pk, self.get_names())
+
+
+class MembershipCacheTests(RecipeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.viewer)
+        self.first, self.second = Recipe.objects.exclude(
+            pk=self.recipe.pk
+        )[:2]
+
+    def toggle(self, method, url):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(url)
+        self.assertLess(response.status_code, 300)
+
+    def get_flags(self, recipe):
+        data = self.client.get(f'/api/recipes/{recipe.pk}/').data
+        return data['is_favorited'], data['is_in_shopping_cart']
+
+    def test_toggles_reach_cached_sets(self):
+        # Cache the sets first.
+        self.get_ids('/api/recipes/?is_favorited=true')
+        self.toggle('get', f'/api/recipes/{self.first.pk}/favorite/')
+        self.toggle('get', f'/api/recipes/{self.second.pk}/favorite/')
+        self.toggle('get', f'/api/recipes/{self.second.pk}/shopping_cart/')
+
+        self.assertEqual(self.get_flags(self.first), (True, False))
+        self.assertEqual(self.get_flags(self.second), (True, True))
+        self.assertEqual(
+            sorted(self.get_ids('/api/recipes/?is_favorited=true')),
+            sorted([self.recipe.pk, self.first.pk, self.second.pk]),
+        )
+        self.assertEqual(
+            sorted(self.get_ids('/api/recipes/?is_in_shopping_cart=true')),
+            sorted([self.recipe.pk, self.second.pk]),
+        )
+
+        self.toggle('delete', f'/api/recipes/{self.recipe.pk}/favorite/')
+        self.toggle('delete', f'/api/users/{self.author.pk}/subscribe/')
+        self.assertEqual(self.get_flags(self.recipe), (False, True))
+        self.assertFalse(
+            self.client.get(
+                f'/api/recipes/{self.recipe.pk}/'
+            ).data['author']['is_subscribed']
+        )
+        self.assertEqual(
+            sorted(self.get_ids('/api/recipes/?is_favorited=true')),
+            sorted([self.first.pk, self.second.pk]),
+        )
+
+    def test_set_loaded_before_a_change_is_not_served(self):
+        stale = load_membership(self.viewer.pk, FAVORITES)
+
+        def load_then_change(user_id, kind):
+            # A concurrent favorite commits while this read is running.
+            self.toggle('get', f'/api/recipes/{self.first.pk}/favorite/')
+            return stale
+
+        with mock.patch(
+            'api.memberships.load_membership', side_effect=load_then_change
+        ):
+            self.assertNotIn(
+                self.first.pk, Memberships(self.viewer).favorites
+            )
+        self.assertIn(self.first.pk, Memberships(self.viewer).favorites)
+        self.assertIn(
+            self.first.pk, self.get_ids('/api/recipes/?is_favorited=true')
+        )
+
+
+class ShoppingCartTotalsTests(RecipeTestCase):
+    """The stored cart totals must match the ones summed from the carts
+    after every change of a cart or of a recipe in it.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.viewer)
+        # Recipes sharing the ingredients of self.recipe.
+        self.first, self.second = Recipe.objects.filter(
+            recipe_ingredients__ingredient=self.ingredients[1]
+        ).exclude(pk=self.recipe.pk).distinct()[:2]
+
+    def assert_totals(self):
+        stored = {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total in (
+                ShoppingCartIngredient.objects.values_list(
+                    'user', 'ingredient', 'total_amount'
+                )
+            )
+        }
+        self.assertEqual(stored, get_source_totals())
+        stdout = StringIO()
+        call_command('rebuild_shopping_cart', '--check', stdout=stdout)
+        self.assertIn(' 0 drifted', stdout.getvalue())
+        return stored
+
+    def test_totals_follow_cart_changes(self):
+        self.client.get(f'/api/recipes/{self.first.pk}/shopping_cart/')
+        totals = self.assert_totals()
+        self.assertEqual(
+            totals[self.viewer.pk, self.ingredients[1].pk],
+            self.recipe.recipe_ingredients.get(
+                ingredient=self.ingredients[1]
+            ).amount
+            + self.first.recipe_ingredients.get(
+                ingredient=self.ingredients[1]
+            ).amount,
+        )
+        url = '/api/recipes/shopping_cart/'
+        ids = {'ids': [self.first.pk, self.second.pk]}
+        self.client.post(url, ids, format='json')
+        self.assert_totals()
+        self.client.delete(url, ids, format='json')
+        self.assert_totals()
+        self.client.delete(f'/api/recipes/{self.recipe.pk}/shopping_cart/')
+        self.assertEqual(self.assert_totals(), {})
+
+    def test_totals_follow_recipe_edit(self):
+        self.first.users_put_in_cart.add(self.author)
+        call_command('rebuild_shopping_cart', stdout=StringIO())
+        amounts = dict(
+            self.first.recipe_ingredients.values_list('ingredient', 'amount')
+        )
+        kept, changed, *_ = amounts
+        self.client.force_authenticate(self.author)
+        response = self.client.patch(
+            f'/api/recipes/{self.first.pk}/',
+            {
+                'ingredients': [
+                    {'id': kept, 'amount': amounts[kept]},
+                    {'id': changed, 'amount': amounts[changed] + 7},
+                    {'id': self.ingredients[0].pk, 'amount': 3},
+                ],
+                'tags': [tag.pk for tag in self.first.tags.all()],
+            },
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        totals = self.assert_totals()
+        self.assertEqual(
+            totals[self.author.pk, changed], amounts[changed] + 7
+        )
+        self.assertEqual(totals[self.author.pk, self.ingredients[0].pk], 3)
+        self.assertEqual(
+            {
+                ingredient for user, ingredient in totals
+                if user == self.author.pk
+            },
+            {kept, changed, self.ingredients[0].pk},
+        )
+
+    def test_totals_drop_with_deleted_recipe(self):
+        self.first.users_put_in_cart.add(self.viewer)
+        call_command('rebuild_shopping_cart', stdout=StringIO())
+        self.client.force_authenticate(self.author)
+        self.client.delete(f'/api/recipes/{self.recipe.pk}/')
+        totals = self.assert_totals()
+        self.assertEqual(
+            totals, {
+                (self.viewer.pk, ingredient): amount
+                for ingredient, amount in (
+                    self.first.recipe_ingredients.values_list(
+                        'ingredient', 'amount'
+                    )
+                )
+            }
+        )
+
+
+class FeedTests(RecipeTestCase):
+    """Pushed timelines and pulled authors must page as one feed."""
+
+    def setUp(self):
+        super().setUp()
+        # The fixture follows the author without going through the view.
+        backfill_feed(self.viewer.pk, self.author.pk)
+        self.other = User.objects.create_user(
+            username='other', email='other@example.com', password='pass',
+            first_name='Other', last_name='Other',
+        )
+        for i in range(4):
+            Recipe.objects.create(
+                author=self.other, name=f'Other {i}', text='Text',
+                cooking_time=1,
+                image=SimpleUploadedFile('recipe.png', IMAGE),
+            )
+        self.client.force_authenticate(self.viewer)
+
+    def subscribe(self, user, method='get'):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(
+                f'/api/users/{user.pk}/subscribe/'
+            )
+        self.assertLess(response.status_code, 300)
+
+    def publish(self, author):
+        self.client.force_authenticate(author)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/recipes/', {
+                'ingredients': [{'id': self.ingredients[0].pk, 'amount': 1}],
+                'tags': [self.tags[0].pk],
+                'image': 'data:image/png;base64,'
+                         + base64.b64encode(IMAGE).decode(),
+                'name': 'New',
+                'text': 'Text',
+                'cooking_time': 1,
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.client.force_authenticate(self.viewer)
+        return Recipe.objects.filter(author=author).latest('id').pk
+
+    def get_expected(self):
+        return list(Recipe.objects.filter(
+            author__following__user=self.viewer
+        ).order_by('-pub_date', '-id').values_list('id', flat=True))
+
+    def read_feed(self, url='/api/recipes/feed/?limit=3'):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 3)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(len(ids), len(set(ids)))
+        return ids
+
+    def test_pushed_feed_across_cursors(self):
+        self.subscribe(self.other)
+        self.publish(self.author)
+        self.publish(self.other)
+        self.assertEqual(self.read_feed(), self.get_expected())
+
+    def test_pulled_authors_merge_with_pushed(self):
+        self.subscribe(self.other)
+        fan = User.objects.create_user(
+            username='fan', email='fan@example.com', password='pass',
+            first_name='Fan', last_name='Fan',
+        )
+        Follow.objects.create(user=fan, following=self.author)
+        call_command('recount', stdout=StringIO())
+        with override_settings(FEED_FANOUT_MAX_FOLLOWERS=2):
+            pulled = self.publish(self.author)
+            pushed = self.publish(self.other)
+            self.assertEqual(self.read_feed(), self.get_expected())
+        self.assertFalse(
+            FeedEntry.objects.filter(user=self.viewer, recipe=pulled).exists()
+        )
+        self.assertTrue(
+            FeedEntry.objects.filter(user=self.viewer, recipe=pushed).exists()
+        )
+
+    def test_publish_while_paging(self):
+        self.subscribe(self.other)
+        expected = self.get_expected()
+        first_page = self.client.get('/api/recipes/feed/?limit=3').data
+        self.publish(self.other)
+        rest = self.read_feed(first_page['next'])
+        self.assertEqual(
+            [item['id'] for item in first_page['results']] + rest, expected
+        )
+
+    def test_unsubscribe_removes_author(self):
+        self.subscribe(self.other)
+        self.subscribe(self.other, 'delete')
+        self.assertEqual(self.read_feed(), self.get_expected())
+        self.assertEqual(
+            set(self.read_feed()),
+            set(self.author.recipes.values_list('id', flat=True)),
+        )
+
+
+class CookableIndexTests(RecipeTestCase):
+    """The ingredient index must rank like the query it replaces."""
+
+    def setUp(self):
+        super().setUp()
+        self.index = RecipeIngredientIndex()
+
+    def assert_ranks(self, seed):
+        rng = random.Random(seed)
+        ingredient_ids = [ingredient.pk for ingredient in self.ingredients]
+        for _ in range(20):
+            ids = rng.sample(ingredient_ids, rng.randint(1, 6))
+            limit = rng.choice((3, 500))
+            with self.subTest(ids=ids, limit=limit):
+                self.assertEqual(
+                    self.index.rank(ids, limit),
+                    rank_cookable_recipes_in_db(ids, limit),
+                )
+
+    def test_rank_matches_database(self):
+        self.assert_ranks(0)
+
+    def test_rank_follows_recipe_writes(self):
+        self.assert_ranks(1)
+        edited, deleted = Recipe.objects.exclude(pk=self.recipe.pk)[:2]
+        self.client.force_authenticate(self.author)
+        response = self.client.patch(f'/api/recipes/{edited.pk}/', {
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': 1}
+                for ingredient in self.ingredients[:7]
+            ],
+            'tags': [self.tags[0].pk],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.client.delete(f'/api/recipes/{deleted.pk}/')
+        created = Recipe.objects.create(
+            author=self.author, name='New', text='Text', cooking_time=1,
+            image=SimpleUploadedFile('recipe.png', IMAGE),
+        )
+        IngredientRecipe.objects.create(
+            recipe=created, ingredient=self.ingredients[0], amount=1
+        )
+        # Synced from the changed content versions, not rebuilt.
+        with mock.patch.object(RecipeIngredientIndex, 'build') as build:
+            self.assert_ranks(2)
+        build.assert_not_called()
+
+    def test_filter_orders_by_coverage(self):
+        ids = [ingredient.pk for ingredient in self.ingredients[:3]]
+        self.assertEqual(
+            self.get_ids(
+                '/api/recipes/?limit=999&ingredients='
+                + ','.join(map(str, ids))
+            ),
+            [
+                recipe_id
+                for recipe_id, _ in rank_cookable_recipes_in_db(ids, 500)
+            ],
+        )
+
+
+class RecipeFragmentTests(RecipeTestCase):
+    """Viewer changes keep the cached fragment of a recipe, content
+    changes replace it.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.url = f'/api/recipes/{self.recipe.pk}/'
+        self.client.force_authenticate(self.viewer)
+        self.client.get(self.url)
+
+    def get(self, rebuilt):
+        with mock.patch(
+            'api.fragments.build_fragments', wraps=build_fragments
+        ) as build:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(build.called, rebuilt)
+        return response.data
+
+    def test_viewer_changes_keep_the_fragment(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'{self.url}favorite/')
+            self.client.delete(f'{self.url}shopping_cart/')
+            self.client.delete(f'/api/users/{self.author.pk}/subscribe/')
+        self.author.save(update_fields=['last_login'])
+        data = self.get(rebuilt=False)
+        self.assertFalse(data['is_favorited'])
+        self.assertFalse(data['is_in_shopping_cart'])
+        self.assertFalse(data['author']['is_subscribed'])
+
+    def test_content_changes_replace_the_fragment(self):
+        tag = self.recipe.tags.first()
+        ingredient = self.recipe.recipe_ingredients.first().ingredient
+        changes = {
+            'author': (
+                self.author, 'first_name',
+                lambda data: data['author']['first_name'],
+            ),
+            'tag': (
+                tag, 'name',
+                lambda data: {item['name'] for item in data['tags']},
+            ),
+            'ingredient': (
+                ingredient, 'name',
+                lambda data: {item['name'] for item in data['ingredients']},
+            ),
+            'recipe': (self.recipe, 'name', lambda data: data['name']),
+        }
+        for label, (instance, field, read) in changes.items():
+            with self.subTest(label):
+                setattr(instance, field, f'Renamed {label}')
+                instance.save()
+                value = read(self.get(rebuilt=True))
+                self.assertIn(f'Renamed {label}', value)
+                self.get(rebuilt=False)
+
+
+class StoredFileTests(RecipeTestCase):
+    """Reference counts of the media files and the deferred sweep.
+
+    Files outlive the test transactions, so every test uploads images of
+    its own color and leaves the fixture's files alone.
+    """
+
+    def make_recipe(self, image):
+        recipe = Recipe.objects.create(
+            author=self.author, name='New', text='Text', cooking_time=1,
+            image=SimpleUploadedFile('recipe.png', image),
+        )
+        return recipe, get_recipe_files(recipe)
+
+    @staticmethod
+    def make_image(color):
+        buffer = BytesIO()
+        Image.new('RGB', (2, 2), color).save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def get_references(self, names):
+        return dict(
+            StoredFile.objects.filter(
+                name__in=names
+            ).values_list('name', 'references')
+        )
+
+    def release_long_ago(self, names):
+        StoredFile.objects.filter(name__in=names).update(
+            released_at=timezone.now() - timedelta(days=2)
+        )
+
+    def test_same_content_is_stored_once(self):
+        names = get_recipe_files(self.recipe)
+        # The image and its WebP and JPEG variants.
+        self.assertEqual(len(names), 3)
+        self.assertEqual(
+            self.get_references(names),
+            dict.fromkeys(names, RECIPES_COUNT),
+        )
+        for recipe in Recipe.objects.all():
+            self.assertEqual(get_recipe_files(recipe), names)
+
+    def test_update_moves_references(self):
+        old_names = get_recipe_files(self.recipe)
+        self.client.force_authenticate(self.author)
+        response = self.client.patch(f'/api/recipes/{self.recipe.pk}/', {
+            'image': 'data:image/png;base64,'
+                     + base64.b64encode(self.make_image('red')).decode(),
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.recipe.refresh_from_db()
+        new_names = get_recipe_files(self.recipe)
+        self.assertFalse(old_names & new_names)
+        self.assertEqual(
+            self.get_references(old_names | new_names),
+            {
+                **dict.fromkeys(old_names, RECIPES_COUNT - 1),
+                **dict.fromkeys(new_names, 1),
+            },
+        )
+        self.assertFalse(StoredFile.objects.filter(
+            name__in=new_names, released_at__isnull=False
+        ).exists())
+
+    def test_sweep_waits_for_the_grace_period(self):
+        image = self.make_image('blue')
+        first, names = self.make_recipe(image)
+        second, _ = self.make_recipe(image)
+        self.assertEqual(self.get_references(names), dict.fromkeys(names, 2))
+        first.delete()
+        self.assertFalse(StoredFile.objects.filter(
+            name__in=names, released_at__isnull=False
+        ).exists())
+        second.delete()
+        self.assertEqual(self.get_references(names), dict.fromkeys(names, 0))
+        self.assertEqual(StoredFile.objects.filter(
+            name__in=names, released_at__isnull=False
+        ).count(), len(names))
+
+        self.assertEqual(delete_unused_files(), 0)
+        with override_settings(MEDIA_UNUSED_FILE_GRACE_PERIOD=0):
+            self.assertEqual(delete_unused_files(), len(names))
+        self.assertEqual(self.get_references(names), {})
+        for name in names:
+            self.assertFalse(default_storage.exists(name))
+        for name in get_recipe_files(self.recipe):
+            self.assertTrue(default_storage.exists(name))
+
+    def test_reuse_restarts_the_grace_period(self):
+        image = self.make_image('green')
+        recipe, names = self.make_recipe(image)
+        recipe.delete()
+        self.release_long_ago(names)
+        self.make_recipe(image)
+        self.assertEqual(self.get_references(names), dict.fromkeys(names, 1))
+        with override_settings(MEDIA_UNUSED_FILE_GRACE_PERIOD=0):
+            self.assertEqual(delete_unused_files(), 0)
+
+        Recipe.objects.filter(image__in=names).delete()
+        self.release_long_ago(names)
+        image_name, = {
+            name for name in names if name.endswith('.png')
+        }
+        # Saving the same content again only claims the existing file.
+        self.assertEqual(
+            default_storage.save('recipes/again.png', ContentFile(image)),
+            image_name,
+        )
+        self.assertEqual(delete_unused_files(), len(names) - 1)
+        self.assertTrue(default_storage.exists(image_name))
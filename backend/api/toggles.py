@@ -0,0 +1,64 @@
+from django.db import connection
+
+from .models import Recipe
+
+
+def get_relation(related_name):
+    through = getattr(Recipe, related_name).through
+    quote = connection.ops.quote_name
+    return (
+        quote(through._meta.db_table),
+        quote(through._meta.get_field('recipe').column),
+        quote(through._meta.get_field('user').column),
+    )
+
+
+def add_recipes_to_category(related_name, recipe_ids, user_id):
+    """Insert the pairs in one statement, return the ids actually added.
+
+    The unique (recipe, user) constraint of the through table settles
+    concurrent requests, so a double click can never add the row twice.
+    """
+    recipe_ids = list(dict.fromkeys(recipe_ids))
+    if not recipe_ids:
+        return set()
+    table, recipe_column, user_column = get_relation(related_name)
+    values = ', '.join(['(%s, %s)'] * len(recipe_ids))
+    params = [
+        param for recipe_id in recipe_ids for param in (recipe_id, user_id)
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({recipe_column}, {user_column}) '
+            f'VALUES {values} ON CONFLICT DO NOTHING '
+            f'RETURNING {recipe_column}',
+            params,
+        )
+        return {recipe_id for recipe_id, in cursor.fetchall()}
+
+
+def remove_recipes_from_category(related_name, recipe_ids, user_id):
+    """Delete the pairs in one statement, return the ids actually removed."""
+    recipe_ids = list(dict.fromkeys(recipe_ids))
+    if not recipe_ids:
+        return set()
+    table, recipe_column, user_column = get_relation(related_name)
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE {user_column} = %s '
+            f'AND {recipe_column} IN ({placeholders}) '
+            f'RETURNING {recipe_column}',
+            [user_id, *recipe_ids],
+        )
+        return {recipe_id for recipe_id, in cursor.fetchall()}
+
+
+def add_recipe_to_category(related_name, recipe_id, user_id):
+    return bool(add_recipes_to_category(related_name, [recipe_id], user_id))
+
+
+def remove_recipe_from_category(related_name, recipe_id, user_id):
+    return bool(
+        remove_recipes_from_category(related_name, [recipe_id], user_id)
+    )
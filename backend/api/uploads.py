@@ -0,0 +1,116 @@
+import json
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http.multipartparser import MultiPartParserError
+from PIL import Image, UnidentifiedImageError
+
+# Enough for any header Pillow needs to report format and size, a JPEG
+# with a full EXIF segment in front of its frame header included.
+IMAGE_HEADER_MAX_SIZE = 256 * 1024
+
+# Form fields carrying nested data are sent JSON encoded in multipart
+# requests.
+JSON_FORM_FIELDS = ('ingredients',)
+
+
+class ImageUploadError(MultiPartParserError):
+    pass
+
+
+def get_max_body_size():
+    return (
+        settings.RECIPE_IMAGE_MAX_SIZE
+        + (settings.DATA_UPLOAD_MAX_MEMORY_SIZE or 0)
+    )
+
+
+def open_image_header(file):
+    """Read format and size of an image without decoding its pixels.
+
+    ``Image.open`` is lazy: it only parses the header, so the check costs
+    the same for a thumbnail and for a decompression bomb. Returns
+    ``None`` when the data is not an image in one of the allowed formats.
+    Raises ``ValueError`` when the image is too large.
+    """
+    try:
+        image = Image.open(file)
+    except Image.DecompressionBombError:
+        raise ValueError('Image dimensions are too large')
+    except (UnidentifiedImageError, OSError):
+        return None
+    if image.format not in settings.RECIPE_IMAGE_FORMATS:
+        return None
+    if max(image.size) > settings.RECIPE_IMAGE_MAX_DIMENSION:
+        raise ValueError('Image dimensions are too large')
+    return image
+
+
+class RecipeImageUploadHandler(TemporaryFileUploadHandler):
+    """Stream uploaded images to a temporary file, enforcing the limits.
+
+    The request is rejected from the declared length when possible, and
+    otherwise as soon as the limit is crossed or the header has been
+    read, so an oversized or non-image upload never reaches the disk in
+    full.
+    """
+
+    def handle_raw_input(self, input_data, META, content_length, boundary,
+                         encoding=None):
+        if content_length > get_max_body_size():
+            raise ImageUploadError('Request body is too large')
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.header = BytesIO()
+        self.header_checked = False
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.RECIPE_IMAGE_MAX_SIZE:
+            raise ImageUploadError('Image file is too large')
+        if not self.header_checked:
+            self.check_header(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def check_header(self, raw_data):
+        self.header.write(raw_data[:IMAGE_HEADER_MAX_SIZE])
+        self.header.seek(0)
+        try:
+            image = open_image_header(self.header)
+        except ValueError as error:
+            raise ImageUploadError(str(error))
+        if image is not None:
+            self.header_checked = True
+            self.header = None
+        elif self.header.getbuffer().nbytes >= IMAGE_HEADER_MAX_SIZE:
+            raise ImageUploadError('Upload a valid image')
+        else:
+            self.header.seek(0, 2)
+
+    def file_complete(self, file_size):
+        if not self.header_checked:
+            raise ImageUploadError('Upload a valid image')
+        return super().file_complete(file_size)
+
+
+def get_form_data(data):
+    """Turn a multipart ``QueryDict`` into the shape of the JSON body."""
+    form_data = data.dict()
+    if 'tags' in data:
+        form_data['tags'] = data.getlist('tags')
+        if len(form_data['tags']) == 1:
+            try:
+                tags = json.loads(form_data['tags'][0])
+            except ValueError:
+                pass
+            else:
+                if isinstance(tags, list):
+                    form_data['tags'] = tags
+    for field in JSON_FORM_FIELDS:
+        if field in form_data:
+            try:
+                form_data[field] = json.loads(form_data[field])
+            except ValueError:
+                pass
+    return form_data
@@ -1,4 +1,5 @@
 from collections import namedtuple
+from functools import wraps
 from typing import List
 
 from rest_framework import status
@@ -11,6 +12,7 @@ ValidationResult = namedtuple(
 
 def validate_query_params(validators: List):
     def decorator(method):
+        @wraps(method)
         def wrapper(self, *args, **kwargs):
             params_errors = {}
             for validate in validators:
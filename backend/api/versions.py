@@ -0,0 +1,122 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import ContentVersion
+
+TAGS_VERSION = 'tags'
+INGREDIENTS_VERSION = 'ingredients'
+RECIPE_CONTENT_VERSION_PREFIX = 'recipe-content:'
+
+# Fields of a user rendered inside recipes.
+USER_PROFILE_FIELDS = ('email', 'username', 'first_name', 'last_name')
+
+
+def recipe_version_key(recipe_id):
+    """Key of everything shown for a recipe, its counters included."""
+    return f'recipe:{recipe_id}'
+
+
+def recipe_content_version_key(recipe_id):
+    """Key of the recipe itself, bumped only when its content changes."""
+    return f'{RECIPE_CONTENT_VERSION_PREFIX}{recipe_id}'
+
+
+def get_changed_recipe_ids(since):
+    """Return ids of the recipes whose content changed after ``since``."""
+    keys = ContentVersion.objects.filter(
+        key__startswith=RECIPE_CONTENT_VERSION_PREFIX, modified__gte=since
+    ).values_list('key', flat=True)
+    return [
+        int(key[len(RECIPE_CONTENT_VERSION_PREFIX):]) for key in keys
+        if key[len(RECIPE_CONTENT_VERSION_PREFIX):].isdigit()
+    ]
+
+
+def user_version_key(user_id):
+    return f'user:{user_id}'
+
+
+def user_content_version_key(user_id):
+    return f'user-content:{user_id}'
+
+
+def static_keys(*keys):
+    return lambda *args, **kwargs: list(keys)
+
+
+def bump_version(*keys, parent=None):
+    """Bump the versions of ``keys``, setting their ``parent`` if given."""
+    fields = {} if parent is None else {'parent': parent}
+    for key in keys:
+        updated = ContentVersion.objects.filter(key=key).update(
+            version=F('version') + 1, modified=timezone.now(), **fields
+        )
+        if updated:
+            continue
+        try:
+            with transaction.atomic():
+                ContentVersion.objects.create(key=key, version=1, **fields)
+        except IntegrityError:
+            ContentVersion.objects.filter(key=key).update(
+                version=F('version') + 1, modified=timezone.now(), **fields
+            )
+
+
+def get_version_map(keys):
+    """Return ``{key: version}`` for the given keys, 0 for unknown ones."""
+    versions = dict(
+        ContentVersion.objects.filter(key__in=keys).values_list(
+            'key', 'version'
+        )
+    )
+    return {key: versions.get(key, 0) for key in keys}
+
+
+def get_versions(keys):
+    """Return ``(etag, last_modified)`` of the given version keys.
+
+    The versions of their parents are included, in the same query.
+    """
+    parents = ContentVersion.objects.filter(key__in=keys).exclude(
+        parent=''
+    ).values('parent')
+    rows = {
+        row.key: row for row in ContentVersion.objects.filter(
+            Q(key__in=keys) | Q(key__in=parents)
+        )
+    }
+    keys = [*keys, *sorted({
+        rows[key].parent for key in keys if key in rows and rows[key].parent
+    })]
+    etag = '.'.join(
+        str(rows[key].version) if key in rows else '0' for key in keys
+    )
+    modified = [row.modified for row in rows.values()]
+    return etag, max(modified) if modified else None
+
+
+def versioned(get_keys, per_user=False):
+    """Build ``etag_func``/``last_modified_func`` for ``condition()``.
+
+    Versions are looked up once per request and shared by both functions.
+    """
+
+    def lookup(request, *args, **kwargs):
+        cached = getattr(request, '_content_versions', {})
+        if get_keys not in cached:
+            cached[get_keys] = get_versions(get_keys(*args, **kwargs))
+            request._content_versions = cached
+        return cached[get_keys]
+
+    def etag_func(request, *args, **kwargs):
+        etag, _ = lookup(request, *args, **kwargs)
+        if per_user:
+            etag = f'{request.user.id or 0}-{etag}'
+        return etag
+
+    def last_modified_func(request, *args, **kwargs):
+        _, last_modified = lookup(request, *args, **kwargs)
+        return last_modified
+
+    return {'etag_func': etag_func, 'last_modified_func': last_modified_func}
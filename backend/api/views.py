@@ -1,19 +1,54 @@
-from django.http import HttpResponse
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.http import Http404, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_headers
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser, MultiPartParser
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
-from .constants import IS_FAVORITED_VALUES, IS_IN_SHOPING_CART_VALUES
+from .autocomplete import search_ingredients
+from .cache import get_cached_response, get_recipe_list_cache_key
+from .constants import (IS_FAVORITED_VALUES, IS_IN_SHOPING_CART_VALUES,
+                        SHOPPING_CART_FORMATS)
+from .counters import CATEGORY_COUNTERS, change_counters
+from .exports import SHOPPING_CART_RENDERERS
+from .feed import fan_out_recipe, get_feed_sources, trim_feed
 from .filters import IngredientFilter, RecipeFilter
-from .models import (Favorite, Ingredient, Recipe, ShopingList,
-                     ShopingListRecipe, Tag)
-from .paginations import DefaultPagination
+from .fragments import get_recipe_queryset, render_recipes
+from .memberships import CATEGORY_MEMBERSHIPS, update_membership
+from .models import Ingredient, Recipe, ShoppingCartIngredient, Tag
+from .paginations import (DefaultPagination, KeysetPagination,
+                          MergedKeysetPagination)
 from .permissions import IsAuthor
-from .serializers import (IngredientListSerializer, RecipeCreateSerializer,
-                          RecipeListSerializer, RecipeSerializer,
-                          TagSerializer)
+from .serializers import (IngredientListSerializer, RecipeBatchSerializer,
+                          RecipeCreateSerializer, RecipeListSerializer,
+                          RecipeSerializer, TagSerializer)
+from .shopping_cart import add_recipes_to_cart, remove_recipes_from_cart
+from .toggles import (add_recipe_to_category, add_recipes_to_category,
+                      remove_recipe_from_category,
+                      remove_recipes_from_category)
+from .uploads import RecipeImageUploadHandler
 from .validations import ValidationResult, validate_query_params
+from .versions import (INGREDIENTS_VERSION, TAGS_VERSION, bump_version,
+                       recipe_version_key, static_keys, versioned)
+
+
+def get_recipe_version_keys(pk):
+    # The author's version comes along as the parent of the recipe's.
+    return [recipe_version_key(pk), TAGS_VERSION, INGREDIENTS_VERSION]
+
+
+ingredients_condition = method_decorator(
+    condition(**versioned(static_keys(INGREDIENTS_VERSION)))
+)
+tags_condition = method_decorator(
+    condition(**versioned(static_keys(TAGS_VERSION)))
+)
 
 
 class RecipeViewSet(viewsets.ModelViewSet):
@@ -27,9 +62,20 @@ class RecipeViewSet(viewsets.ModelViewSet):
         'partial_update': [IsAuthor],
         'destroy': [IsAuthor],
         'favorite': [IsAuthenticated],
+        'shopping_cart': [IsAuthenticated],
+        'favorite_batch': [IsAuthenticated],
+        'shopping_cart_batch': [IsAuthenticated],
+        'batch': [AllowAny],
+        'feed': [IsAuthenticated],
+        'download_shopping_cart': [IsAuthenticated],
     }
     filter_class = RecipeFilter
     pagination_class = DefaultPagination
+    parser_classes = (JSONParser, MultiPartParser)
+
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers = [RecipeImageUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
 
     def get_serializer_class(self):
         if self.request.method in ('POST', 'PUT', 'PATCH'):
@@ -37,6 +83,12 @@ class RecipeViewSet(viewsets.ModelViewSet):
         else:
             return RecipeSerializer
 
+    def get_queryset(self):
+        if self.action not in ('list', 'retrieve', 'batch', 'feed'):
+            return super().get_queryset()
+
+        return get_recipe_queryset()
+
     def get_permissions(self):
         try:
             permissions = []
@@ -71,14 +123,65 @@ class RecipeViewSet(viewsets.ModelViewSet):
             )
         return ValidationResult(True, 'is_in_shoping_cart', '')
 
+    def validate_shopping_cart_format(self):
+        file_format = self.request.query_params.get('type')
+        if file_format and file_format not in SHOPPING_CART_FORMATS:
+            return ValidationResult(
+                False,
+                'type',
+                'Invalid value. Acceptable "txt", "csv" and "pdf"',
+            )
+        return ValidationResult(True, 'type', '')
+
     @validate_query_params(
         [validate_is_favorited, validate_is_in_shoping_cart]
     )
     def list(self, request, *args, **kwargs):
-        return super().list(self, request, *args, **kwargs)
+        if not self.is_list_cacheable():
+            return self.list_recipes(request, *args, **kwargs)
+        return get_cached_response(
+            get_recipe_list_cache_key(request),
+            lambda: self.list_recipes(request, *args, **kwargs),
+        )
 
+    def list_recipes(self, request, *args, **kwargs):
+        if not settings.RECIPE_FRAGMENT_CACHE_ENABLED:
+            return super().list(request, *args, **kwargs)
+        page = self.paginate_queryset(
+            self.filter_queryset(Recipe.objects.only('id', 'pub_date'))
+        )
+        return self.get_paginated_response(
+            render_recipes(request, [recipe.pk for recipe in page])
+        )
+
+    def is_list_cacheable(self):
+        params = self.request.query_params
+        return not (
+            self.request.user.is_authenticated
+            or 'is_favorited' in params
+            or 'is_in_shopping_cart' in params
+        )
+
+    @method_decorator(vary_on_headers('Authorization'))
+    @method_decorator(
+        condition(**versioned(get_recipe_version_keys, per_user=True))
+    )
+    def retrieve(self, request, *args, **kwargs):
+        if not settings.RECIPE_FRAGMENT_CACHE_ENABLED:
+            return super().retrieve(request, *args, **kwargs)
+        try:
+            recipe_id = int(kwargs[self.lookup_field])
+        except ValueError:
+            raise Http404
+        recipes = render_recipes(request, [recipe_id])
+        if not recipes:
+            raise Http404
+        return Response(recipes[0])
+
+    @transaction.atomic
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        recipe = serializer.save(author=self.request.user)
+        fan_out_recipe(recipe)
 
     def perform_update(self, serializer):
         serializer.save(author=self.request.user)
@@ -87,33 +190,6 @@ class RecipeViewSet(viewsets.ModelViewSet):
         kwargs['partial'] = True
         return self.update(request, *args, **kwargs)
 
-    def add_recipe_in_category(self, queryset_users, curent_user, recipe):
-        if queryset_users.filter(pk=curent_user.pk).exists():
-            return Response(
-                status=status.HTTP_400_BAD_REQUEST,
-                data={'errors': 'the recipe has already been added'},
-            )
-
-        shoping_list, shoping_list_created = ShopingList.objects.get_or_create(
-            user=curent_user
-        )
-        ShopingListRecipe.objects.get_or_create(
-            recipe=recipe,
-            shoping_list=shoping_list
-        )
-        queryset_users.add(curent_user)
-        serializer = RecipeListSerializer(recipe)
-        return Response(status=status.HTTP_201_CREATED, data=serializer.data)
-
-    def del_recipe_from_category(self, queryset_users, curent_user):
-        if not queryset_users.filter(pk=curent_user.pk).exists():
-            return Response(
-                status=status.HTTP_400_BAD_REQUEST,
-                data={'errors': 'Recipe not added'},
-            )
-        queryset_users.remove(curent_user)
-        return Response(status=status.HTTP_204_NO_CONTENT)
-
     def handle_recipe_category(
             self, request, recipe_pk, related_name_category
     ):
@@ -125,14 +201,108 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 data={'errors': 'the recipe isn\'t exists'},
             )
 
-        category_users = getattr(recipe, related_name_category)
-        if request.method == 'GET':
-            return self.add_recipe_in_category(
-                category_users, request.user, recipe
+        with transaction.atomic():
+            if request.method == 'GET':
+                if not add_recipe_to_category(
+                    related_name_category, recipe.pk, request.user.pk
+                ):
+                    return Response(
+                        status=status.HTTP_400_BAD_REQUEST,
+                        data={'errors': 'the recipe has already been added'},
+                    )
+                response = Response(
+                    status=status.HTTP_201_CREATED,
+                    data=RecipeListSerializer(recipe).data,
+                )
+                delta = 1
+            else:
+                if not remove_recipe_from_category(
+                    related_name_category, recipe.pk, request.user.pk
+                ):
+                    return Response(
+                        status=status.HTTP_400_BAD_REQUEST,
+                        data={'errors': 'Recipe not added'},
+                    )
+                response = Response(status=status.HTTP_204_NO_CONTENT)
+                delta = -1
+
+            self.apply_category_change(
+                related_name_category, request, [recipe.pk], delta
             )
+        return response
 
+    @staticmethod
+    def apply_category_change(related_name_category, request, recipe_ids,
+                              delta):
+        if not recipe_ids:
+            return
+        kind = CATEGORY_MEMBERSHIPS[related_name_category]
+        if delta > 0:
+            update_membership(request, kind, added=recipe_ids)
         else:
-            return self.del_recipe_from_category(category_users, request.user)
+            update_membership(request, kind, removed=recipe_ids)
+        change_counters(
+            Recipe, recipe_ids, CATEGORY_COUNTERS[related_name_category], delta
+        )
+        bump_version(*(recipe_version_key(pk) for pk in recipe_ids))
+        if related_name_category == 'users_put_in_cart':
+            if delta > 0:
+                add_recipes_to_cart(request.user, recipe_ids)
+            else:
+                remove_recipes_from_cart(request.user, recipe_ids)
+
+    def handle_recipe_category_batch(self, request, related_name_category):
+        serializer = RecipeBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        recipes = Recipe.objects.only(
+            'id', 'name', 'image', 'image_variants', 'cooking_time'
+        ).in_bulk(ids)
+
+        with transaction.atomic():
+            if request.method == 'POST':
+                changed = add_recipes_to_category(
+                    related_name_category, list(recipes), request.user.pk
+                )
+                self.apply_category_change(
+                    related_name_category, request, list(changed), 1
+                )
+            else:
+                changed = remove_recipes_from_category(
+                    related_name_category, list(recipes), request.user.pk
+                )
+                self.apply_category_change(
+                    related_name_category, request, list(changed), -1
+                )
+
+        results = []
+        for pk in ids:
+            if pk not in recipes:
+                results.append({
+                    'id': pk,
+                    'status': status.HTTP_400_BAD_REQUEST,
+                    'errors': 'the recipe isn\'t exists',
+                })
+            elif pk not in changed:
+                results.append({
+                    'id': pk,
+                    'status': status.HTTP_400_BAD_REQUEST,
+                    'errors': (
+                        'the recipe has already been added'
+                        if request.method == 'POST' else 'Recipe not added'
+                    ),
+                })
+            elif request.method == 'POST':
+                results.append({
+                    'id': pk,
+                    'status': status.HTTP_201_CREATED,
+                    'recipe': RecipeListSerializer(recipes[pk]).data,
+                })
+            else:
+                results.append({
+                    'id': pk, 'status': status.HTTP_204_NO_CONTENT
+                })
+        return Response({'results': results})
 
     @action(detail=True, methods=['get', 'delete'], url_name='favorite')
     def favorite(self, request, pk=None):
@@ -144,36 +314,94 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def shopping_cart(self, request, pk=None):
         return self.handle_recipe_category(request, pk, 'users_put_in_cart')
 
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='favorite',
+        url_name='favorite_batch',
+    )
+    def favorite_batch(self, request):
+        return self.handle_recipe_category_batch(
+            request, 'users_chose_as_favorite'
+        )
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='shopping_cart',
+        url_name='shopping_cart_batch',
+    )
+    def shopping_cart_batch(self, request):
+        return self.handle_recipe_category_batch(request, 'users_put_in_cart')
+
+    @action(detail=False, methods=['get'], url_name='feed')
+    def feed(self, request):
+        if not request.query_params.get(KeysetPagination.cursor_query_param):
+            trim_feed(request.user.pk)
+        paginator = MergedKeysetPagination()
+        recipe_ids = paginator.paginate_sources(
+            get_feed_sources(request.user), request
+        )
+        if settings.RECIPE_FRAGMENT_CACHE_ENABLED:
+            return paginator.get_paginated_response(
+                render_recipes(request, recipe_ids)
+            )
+        recipes = self.get_queryset().in_bulk(recipe_ids)
+        serializer = RecipeSerializer(
+            [recipes[pk] for pk in recipe_ids if pk in recipes],
+            many=True,
+            context=self.get_serializer_context(),
+        )
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'], url_name='batch')
+    def batch(self, request):
+        ids = request.query_params.get('ids', '')
+        serializer = RecipeBatchSerializer(
+            data={'ids': [pk for pk in ids.split(',') if pk]}
+        )
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        recipes = {
+            recipe['id']: recipe for recipe in render_recipes(request, ids)
+        }
+        return Response({'results': [
+            {
+                'id': pk,
+                'status': status.HTTP_200_OK,
+                'recipe': recipes[pk],
+            }
+            if pk in recipes else
+            {'id': pk, 'status': status.HTTP_404_NOT_FOUND}
+            for pk in ids
+        ]})
+
     @action(
         detail=False,
         methods=['get'],
         url_path='download_shopping_cart',
         url_name='download_shopping_cart',
     )
+    @validate_query_params([validate_shopping_cart_format])
     def download_shopping_cart(self, request):
-        ingredients = {}
-        user = self.request.user
-        shoping_list = user.shoping_list
-        shoping_list_recipes = shoping_list.list_products.all()
-        recipes = [item.recipe for item in shoping_list_recipes]
-
-        for recipe in recipes:
-            for ingredient_item in recipe.ingredients.all():
-                ingredient_name = ingredient_item.ingredient.name
-                ingredient_measurement_unit = (
-                    ingredient_item.ingredient.measurement_unit
-                )
-                if ingredients.get(ingredient_name) is not None:
-                    ingredients[ingredient_name][0] += ingredient_item.amount
-                else:
-                    ingredients[ingredient_name] = [
-                        ingredient_item.amount, ingredient_measurement_unit
-                    ]
+        file_format = request.query_params.get('type', 'txt')
+        rows = ShoppingCartIngredient.objects.filter(
+            user=request.user
+        ).values(
+            name=F('ingredient__name'),
+            measurement_unit=F('ingredient__measurement_unit'),
+        ).annotate(
+            total_amount=Sum('total_amount')
+        ).order_by('name', 'measurement_unit')
 
-        shoping_list_txt = ''
-        for ingredient, value in ingredients.items():
-            shoping_list_txt += f'{ingredient} ({value[1]}) - {value[0]} \n'
-        return HttpResponse(shoping_list_txt, content_type='text/plain')
+        response = StreamingHttpResponse(
+            SHOPPING_CART_RENDERERS[file_format](rows.iterator()),
+            content_type=SHOPPING_CART_FORMATS[file_format],
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_list.{file_format}"'
+        )
+        return response
 
 
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
@@ -181,9 +409,44 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = IngredientListSerializer
     filter_class = IngredientFilter
 
+    def get_autocomplete_limit(self):
+        try:
+            limit = int(self.request.query_params['limit'])
+        except (KeyError, ValueError):
+            return settings.INGREDIENT_AUTOCOMPLETE_LIMIT
+        return max(1, min(limit, settings.INGREDIENT_AUTOCOMPLETE_MAX_LIMIT))
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('name'):
+            return self.autocomplete(request)
+        return self.list_all(request, *args, **kwargs)
+
+    @ingredients_condition
+    def list_all(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @ingredients_condition
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        # No conditional response: the in-process index answers without
+        # any query, a version lookup would be the only one.
+        return Response(search_ingredients(
+            request.query_params.get('name', ''),
+            self.get_autocomplete_limit(),
+        ))
+
 
 class TagViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
 
-    Favorite.objects.all()
+    @tags_condition
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @tags_condition
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
@@ -28,6 +28,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     # My app
     'api',
@@ -41,7 +42,7 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.CachedTokenAuthentication',
     ),
     "DEFAULT_FILTER_BACKENDS": [
         "django_filters.rest_framework.DjangoFilterBackend"
@@ -101,6 +102,16 @@ DATABASES = {
 }
 
 
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -142,8 +153,79 @@ STATIC_ROOT = os.path.join(BASE_DIR, '/var/html/static/')
 
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "/var/html/media/")
+DEFAULT_FILE_STORAGE = 'api.storage.ContentAddressedStorage'
+# Unused media files are deleted by delete_unused_files after this long.
+MEDIA_UNUSED_FILE_GRACE_PERIOD = 24 * 60 * 60
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Ingredient autocomplete
+
+INGREDIENT_INDEX_ENABLED = True
+INGREDIENT_INDEX_TTL = 300
+INGREDIENT_AUTOCOMPLETE_LIMIT = 20
+INGREDIENT_AUTOCOMPLETE_MAX_LIMIT = 100
+
+# Recipe search
+
+RECIPE_SEARCH_CONFIG = 'russian'
+
+# Anonymous recipe list cache
+
+RECIPE_LIST_CACHE_TIMEOUT = 300
+RECIPE_LIST_CACHE_LOCK_TIMEOUT = 5
+RECIPE_LIST_CACHE_POLL_INTERVAL = 0.05
+
+# Token authentication cache
+# Saving a user or deleting a token clears the shared tier and the local
+# tier of the worker doing it; other workers can keep serving the old
+# user, e.g. a deactivated one, for up to TOKEN_CACHE_TTL seconds.
+
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL = 30
+TOKEN_CACHE_SHARED = False
+TOKEN_SHARED_CACHE_TTL = 300
+
+# Recipe batch endpoints
+
+RECIPE_BATCH_MAX_SIZE = 50
+
+# Subscription feed
+
+FEED_MAX_LENGTH = 1000
+FEED_BACKFILL_SIZE = 100
+FEED_FANOUT_MAX_FOLLOWERS = 10000
+
+# What can I cook
+
+RECIPE_INGREDIENT_INDEX_ENABLED = True
+RECIPE_INGREDIENT_INDEX_TTL = 3600
+RECIPE_INGREDIENT_INDEX_OVERLAP = 60
+RECIPE_COOKABLE_LIMIT = 500
+
+# Recipe fragment cache
+
+RECIPE_FRAGMENT_CACHE_ENABLED = True
+RECIPE_FRAGMENT_CACHE_TIMEOUT = 3600
+
+# Membership sets
+
+MEMBERSHIP_CACHE_TIMEOUT = 3600
+MEMBERSHIP_FILTER_MAX_IDS = 1000
+
+# Recipe image variants
+
+RECIPE_IMAGE_VARIANTS = {
+    'card': (300, 300),
+    'detail': (1200, 1200),
+}
+RECIPE_IMAGE_QUALITY = 80
+
+# Recipe image upload
+
+RECIPE_IMAGE_MAX_SIZE = 10 * 1024 * 1024
+RECIPE_IMAGE_MAX_DIMENSION = 8000
+RECIPE_IMAGE_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
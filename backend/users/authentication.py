@@ -0,0 +1,96 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.authentication import TokenAuthentication
+
+SHARED_CACHE_PREFIX = 'auth:token:'
+
+
+class TTLCache:
+    """Thread-safe LRU mapping whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+token_cache = TTLCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL)
+
+
+def invalidate_tokens(*keys):
+    """Drop cached lookups of the tokens once the transaction commits.
+
+    Dropped earlier, a concurrent request could cache the user as it was
+    before the write again. Only this process's tier is cleared, other
+    workers keep their entries for up to TOKEN_CACHE_TTL seconds.
+    """
+
+    def invalidate():
+        for key in keys:
+            token_cache.delete(key)
+        if settings.TOKEN_CACHE_SHARED:
+            cache.delete_many([SHARED_CACHE_PREFIX + key for key in keys])
+
+    transaction.on_commit(invalidate)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Token authentication that remembers token -> user lookups.
+
+    Hits are served from a per-process LRU and, if TOKEN_CACHE_SHARED is
+    set, from the Django cache. Entries are dropped when the token is
+    deleted or its user is saved, and the local tier expires after
+    TOKEN_CACHE_TTL seconds in any case: the local entries of other
+    workers are only dropped that way.
+
+    The returned user can be that many seconds old: views must re-read it
+    before showing its counters and save only the fields they change.
+    """
+
+    def authenticate_credentials(self, key):
+        credentials = token_cache.get(key)
+        if credentials is None and settings.TOKEN_CACHE_SHARED:
+            credentials = cache.get(SHARED_CACHE_PREFIX + key)
+            if credentials is not None:
+                token_cache.set(key, credentials)
+        if credentials is None:
+            credentials = super().authenticate_credentials(key)
+            token_cache.set(key, credentials)
+            if settings.TOKEN_CACHE_SHARED:
+                cache.set(
+                    SHARED_CACHE_PREFIX + key,
+                    credentials,
+                    settings.TOKEN_SHARED_CACHE_TTL,
+                )
+        user, token = credentials
+        return copy.copy(user), copy.copy(token)
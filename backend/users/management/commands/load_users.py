@@ -1,21 +1,134 @@
 import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 
+import django
+from django.contrib.auth.hashers import make_password
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from rest_framework.authtoken.models import Token
+
+from api.cache import invalidate_all_recipe_lists
+from api.versions import (bump_version, user_content_version_key,
+                          user_version_key)
+from users.authentication import invalidate_tokens
 from users.models import User
 
+PROFILE_FIELDS = ('email', 'username', 'first_name', 'last_name')
+
+
+def hash_password(password):
+    return make_password(password)
+
 
 class Command(BaseCommand):
     help = 'Create test users'
 
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='data/users.json')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Processes used to hash passwords',
+        )
+        parser.add_argument(
+            '--update',
+            action='store_true',
+            help='Update profile and password of existing users',
+        )
+
     def handle(self, *args, **options):
-        with open('data/users.json', encoding='utf-8') as file:
+        with open(options['path'], encoding='utf-8') as file:
             data = json.load(file)
-            for item in data:
-                user, created = User.objects.get_or_create(
-                    username=item['username'],
-                    email=item['email'],
-                    first_name=item['first_name'],
-                    last_name=item['last_name']
+
+        self.created = self.updated = self.skipped = 0
+        self.workers = options['workers']
+        started_at = time.monotonic()
+        batch_size = options['batch_size']
+        with ProcessPoolExecutor(
+            max_workers=self.workers, initializer=django.setup
+        ) as pool:
+            for start in range(0, len(data), batch_size):
+                self.load_batch(
+                    data[start:start + batch_size], pool, options['update']
+                )
+                done = min(start + batch_size, len(data))
+                elapsed = max(time.monotonic() - started_at, 1e-6)
+                self.stdout.write(
+                    f'{done}/{len(data)} users ({done / elapsed:.0f}/s)'
                 )
-                user.set_password(item['password'])
-                user.save()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{self.created} created, {self.updated} updated, '
+            f'{self.skipped} skipped'
+        ))
+
+    def load_batch(self, items, pool, update):
+        existing = {}
+        for user in User.objects.filter(
+            Q(username__in=[item['username'] for item in items])
+            | Q(email__in=[item['email'] for item in items])
+        ):
+            existing[user.username] = user
+            existing[user.email] = user
+
+        new_items, updates, seen = [], [], set()
+        for item in items:
+            if item['username'] in seen or item['email'] in seen:
+                self.skipped += 1
+                continue
+            seen.update((item['username'], item['email']))
+            user = existing.get(item['username'])
+            if user is None and item['email'] not in existing:
+                new_items.append(item)
+            elif update and user is not None and (
+                existing.get(item['email'], user) == user
+            ):
+                updates.append((user, item))
+            else:
+                self.skipped += 1
+
+        passwords = [item['password'] for item in new_items] + [
+            item['password'] for _, item in updates
+        ]
+        chunksize = max(1, len(passwords) // (self.workers * 4))
+        hashes = iter(pool.map(hash_password, passwords, chunksize=chunksize))
+
+        users = [
+            User(
+                **{field: item[field] for field in PROFILE_FIELDS},
+                password=next(hashes),
+            )
+            for item in new_items
+        ]
+        for user, item in updates:
+            for field in PROFILE_FIELDS:
+                setattr(user, field, item[field])
+            user.password = next(hashes)
+
+        with transaction.atomic():
+            User.objects.bulk_create(users)
+            User.objects.bulk_update(
+                [user for user, _ in updates], (*PROFILE_FIELDS, 'password')
+            )
+        if updates:
+            self.invalidate([user.pk for user, _ in updates])
+        self.created += len(users)
+        self.updated += len(updates)
+
+    def invalidate(self, user_ids):
+        """Bulk updates skip post_save, so clear what it would have."""
+        invalidate_tokens(*Token.objects.filter(
+            user_id__in=user_ids
+        ).values_list('key', flat=True))
+        bump_version(*(
+            key for user_id in user_ids
+            for key in (
+                user_version_key(user_id), user_content_version_key(user_id)
+            )
+        ))
+        invalidate_all_recipe_lists()
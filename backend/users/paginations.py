@@ -1,11 +1,15 @@
-from rest_framework.pagination import (LimitOffsetPagination,
-                                       PageNumberPagination)
+from rest_framework.pagination import LimitOffsetPagination
 
+from api.paginations import DefaultPagination as RecipePagination
+from api.paginations import KeysetPagination
 
-class DefaultPagination(PageNumberPagination):
-    page_size = 6
-    max_page_size = 999
-    page_size_query_param = 'limit'
+
+class SubscriptionKeysetPagination(KeysetPagination):
+    ordering = ('id',)
+
+
+class DefaultPagination(RecipePagination):
+    keyset_pagination_class = SubscriptionKeysetPagination
 
 
 class UserPagination(LimitOffsetPagination):
@@ -2,14 +2,14 @@ from django.contrib.auth import get_user_model
 from djoser import serializers as djoser_serializers
 from rest_framework import serializers
 
-from .models import Follow
+from api.memberships import get_memberships
 
 User = get_user_model()
 
 
 class UserSerializer(serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField(read_only=True)
-    recipes_count = serializers.SerializerMethodField(read_only=True)
+    recipes_count = serializers.IntegerField(read_only=True)
     recipes = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
@@ -26,12 +26,10 @@ class UserSerializer(serializers.ModelSerializer):
         )
 
     def get_is_subscribed(self, user_object):
-        return Follow.objects.filter(
-            user=self.context['request'].user.id, following=user_object.id
-        ).exists()
-
-    def get_recipes_count(self, user_object):
-        return user_object.recipes.all().count()
+        if hasattr(user_object, 'is_subscribed'):
+            return user_object.is_subscribed
+        memberships = get_memberships(self.context['request'])
+        return user_object.pk in memberships.following
 
     def get_recipes(self, user_object):
         from api.serializers import RecipeListSerializer
@@ -0,0 +1,59 @@
+from django.core.cache import cache
+from django.test import override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from .authentication import SHARED_CACHE_PREFIX, token_cache
+from .models import User
+
+
+@override_settings(TOKEN_CACHE_SHARED=True)
+class TokenCacheTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='user', email='user@example.com', password='pass',
+            first_name='User', last_name='User',
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def get_me(self):
+        return self.client.get('/api/users/me/')
+
+    def assert_cached(self, cached):
+        self.assertEqual(token_cache.get(self.token.key) is not None, cached)
+        self.assertEqual(
+            cache.get(SHARED_CACHE_PREFIX + self.token.key) is not None,
+            cached,
+        )
+
+    def test_deactivated_user_is_rejected_after_commit(self):
+        self.assertEqual(self.get_me().status_code, 200)
+        self.assert_cached(True)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+            # Cleared before the commit, the old user could be cached
+            # again by a concurrent request.
+            self.assert_cached(True)
+        self.assert_cached(False)
+        self.assertEqual(self.get_me().status_code, 401)
+
+    def test_deleted_token_is_rejected(self):
+        self.assertEqual(self.get_me().status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.token.delete()
+        self.assertEqual(self.get_me().status_code, 401)
+
+    def test_last_login_keeps_the_cache(self):
+        self.assertEqual(self.get_me().status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save(update_fields=['last_login'])
+        self.assert_cached(True)
+
+    def test_me_reads_current_counters(self):
+        self.assertEqual(self.get_me().data['recipes_count'], 0)
+        User.objects.filter(pk=self.user.pk).update(recipes_count=2)
+        self.assertEqual(self.get_me().data['recipes_count'], 2)
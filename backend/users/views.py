@@ -1,5 +1,10 @@
 from django.contrib.auth import get_user_model
-from django.shortcuts import get_list_or_404, get_object_or_404
+from django.db import transaction
+from django.db.models import F, Prefetch, Value
+from django.db.models.expressions import RawSQL, Window
+from django.db.models.functions import RowNumber
+from django.http import Http404
+from django.shortcuts import get_object_or_404
 from djoser import serializers as djoser_serializers
 from djoser.permissions import CurrentUserOrAdmin
 from rest_framework import status, viewsets
@@ -9,6 +14,10 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from api.feed import backfill_feed, remove_author_from_feed
+from api.memberships import FOLLOWING, update_membership
+from api.models import Recipe
+from api.validations import ValidationResult, validate_query_params
 from .models import Follow
 from .paginations import DefaultPagination, UserPagination
 from .serializers import UserCreateSerializer, UserSerializer
@@ -37,7 +46,9 @@ class UserViewSet(viewsets.ModelViewSet):
         return super().get_permissions()
 
     def get_instance(self):
-        return self.request.user
+        # request.user may come from the token cache, so its counters can
+        # be stale.
+        return get_object_or_404(User, pk=self.request.user.pk)
 
     @action(detail=False, methods=["get"])
     def me(self, request, *args, **kwargs):
@@ -49,18 +60,70 @@ class UserViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         self.request.user.set_password(serializer.data["new_password"])
-        self.request.user.save()
+        self.request.user.save(update_fields=['password'])
         return Response(status=status.HTTP_200_OK)
 
 
+def get_latest_recipes(authors, limit):
+    """Return a queryset of at most ``limit`` newest recipes per author.
+
+    The recipes are ranked per author with ROW_NUMBER() so the database
+    does the cut, no matter how many recipes each author has.
+    """
+    ranked = Recipe.objects.filter(author__in=authors).annotate(
+        row_number=Window(
+            expression=RowNumber(),
+            partition_by=[F('author')],
+            order_by=[F('pub_date').desc(), F('id').desc()],
+        )
+    ).order_by().values('id', 'row_number')
+    sql, params = ranked.query.sql_with_params()
+    return Recipe.objects.filter(id__in=RawSQL(
+        f'SELECT ranked.id FROM ({sql}) ranked '
+        f'WHERE ranked.row_number <= %s',
+        (*params, limit),
+    ))
+
+
 class SubscriptionsListViewSet(ListAPIView):
     serializer_class = UserSerializer
     pagination_class = DefaultPagination
 
+    def validate_recipes_limit(self):
+        recipes_limit = self.request.query_params.get('recipes_limit')
+        if recipes_limit is not None and not (
+            recipes_limit.isdigit() and int(recipes_limit) > 0
+        ):
+            return ValidationResult(
+                False,
+                'recipes_limit',
+                'Invalid value. Acceptable a positive integer',
+            )
+        return ValidationResult(True, 'recipes_limit', '')
+
+    @validate_query_params([validate_recipes_limit])
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
     def get_queryset(self):
-        follow_objects = get_list_or_404(Follow, user=self.request.user)
-        subscriptions = [object_.following for object_ in follow_objects]
-        return subscriptions
+        subscriptions = User.objects.filter(
+            following__user=self.request.user
+        ).order_by('id')
+        if not subscriptions.exists():
+            raise Http404
+
+        recipes = Recipe.objects.all()
+        recipes_limit = self.request.query_params.get('recipes_limit')
+        if recipes_limit:
+            recipes = get_latest_recipes(
+                subscriptions.values('id'), int(recipes_limit)
+            )
+        recipes = recipes.only(
+            'id', 'name', 'image', 'image_variants', 'cooking_time', 'author'
+        )
+        return subscriptions.annotate(
+            is_subscribed=Value(True)
+        ).prefetch_related(Prefetch('recipes', queryset=recipes))
 
 
 class SubscribeViewSet(APIView):
@@ -79,10 +142,16 @@ class SubscribeViewSet(APIView):
         )
 
         if not follow_object:
-            Follow.objects.create(
-                user=request.user,
-                following=following
-            )
+            with transaction.atomic():
+                Follow.objects.create(
+                    user=request.user,
+                    following=following
+                )
+                User.objects.filter(pk=following.pk).update(
+                    followers_count=F('followers_count') + 1
+                )
+                backfill_feed(request.user.pk, following.pk)
+                update_membership(request, FOLLOWING, added=[following.pk])
             serializer = UserSerializer(
                 following,
                 context={'request': self.request}
@@ -100,7 +169,15 @@ class SubscribeViewSet(APIView):
             following=following
         )
         if follow_object:
-            follow_object.delete()
+            with transaction.atomic():
+                if follow_object.delete()[0]:
+                    User.objects.filter(pk=following.pk).update(
+                        followers_count=F('followers_count') - 1
+                    )
+                    remove_author_from_feed(request.user.pk, following.pk)
+                    update_membership(
+                        request, FOLLOWING, removed=[following.pk]
+                    )
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(
             {'errors': 'You are not subscribed to the user'},